@@ -10,12 +10,28 @@ Deploy to: Cool Tower NOIR, Warm Tower NOIR
 import os
 import sys
 import time
-from datetime import datetime
+import hashlib
+from datetime import datetime, timedelta
 from pathlib import Path
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 import json
 import socket
+import select
+import fcntl
+import struct
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# orjson is optional on the Pi Zero; fall back to stdlib json
+try:
+    import orjson
+    json_dumps = orjson.dumps
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
 
 # Import picamera2 (only available on Raspberry Pi)
 try:
@@ -25,6 +41,14 @@ except ImportError:
     print("Warning: picamera2 not available. Running in mock mode.")
     Picamera2 = None
 
+# Hardware (VC4) JPEG encoder; older picamera2 builds fall back to software
+try:
+    from picamera2.encoders import MJPEGEncoder, Quality
+    from picamera2.outputs import Output
+except ImportError:
+    MJPEGEncoder = None
+    Output = object
+
 # Load environment variables
 load_dotenv()
 
@@ -53,15 +77,64 @@ IMAGE_DIR.mkdir(parents=True, exist_ok=True)
 IMAGE_WIDTH = 2304
 IMAGE_HEIGHT = 1296
 IMAGE_QUALITY = 85
+ENCODE_TIMEOUT_SECONDS = 5
+CAPTURE_TIMEOUT_SECONDS = 30
+STATUS_SEND_TIMEOUT_SECONDS = 5
+
+# Interfaces checked (in order) for the camera's LAN address
+NETWORK_INTERFACES = ('wlan0', 'eth0')
+SIOCGIFADDR = 0x8915
+
+# HTTP server the RPi5 pulls image files from
+IMAGE_SERVER_PORT = int(os.getenv('IMAGE_SERVER_PORT', 8080))
+
+# Pre-serialized MQTT payloads; per-call fields are appended to the prefixes
+STATUS_OFFLINE_BYTES = json_dumps({
+    'status': 'offline',
+    'tower': TOWER_NAME,
+    'camera': CAMERA_TYPE
+})
+STATUS_ONLINE_PREFIX = json_dumps({
+    'status': 'online',
+    'tower': TOWER_NAME,
+    'camera': CAMERA_TYPE
+})[:-1] + b','
+METADATA_PREFIX = json_dumps({
+    'tower': TOWER_NAME,
+    'camera_type': CAMERA_TYPE,
+    'width': IMAGE_WIDTH,
+    'height': IMAGE_HEIGHT,
+    'spectrum': 'near_infrared'
+})[:-1] + b','
 
 # Capture interval - every 4 hours during lights-on (6am-10pm)
 CAPTURE_INTERVAL_HOURS = 4
 LIGHTS_ON_HOUR = 6
 LIGHTS_OFF_HOUR = 22
+CAPTURE_RETRY_SECONDS = 60
+
+# Local UTC offset for integer hour math; refreshed every capture cycle for DST
+TZ_OFFSET_SECONDS = time.localtime().tm_gmtoff
 
 # MQTT Client
 mqtt_client = None
 camera = None
+image_server = None
+ip_address = None
+
+# Prebuilt MQTT PUBLISH frames for retained status payloads
+status_frames = {}
+
+jpeg_encoder = None
+jpeg_output = None
+jpeg_quality = None
+
+# All libcamera calls run on this one thread; callers only wait on the result
+camera_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='camera')
+
+# Captured requests waiting to be encoded/written by the save worker
+save_queue = queue.Queue()
+save_thread = None
 
 
 def setup_mqtt():
@@ -74,14 +147,9 @@ def setup_mqtt():
     def on_connect(client, userdata, flags, rc):
         if rc == 0:
             print(f"Connected to MQTT broker at {MQTT_BROKER}")
-            # Publish online status
-            status = {
-                'status': 'online',
-                'tower': TOWER_NAME,
-                'camera': CAMERA_TYPE,
-                'ip': get_ip_address()
-            }
-            client.publish(MQTT_TOPIC_STATUS, json.dumps(status), retain=True)
+            # Publish online status (we are on the network thread here)
+            status = STATUS_ONLINE_PREFIX + json_dumps({'ip': get_ip_address()})[1:]
+            publish_status(status)
         else:
             print(f"Failed to connect to MQTT broker, code: {rc}")
     
@@ -94,12 +162,7 @@ def setup_mqtt():
     mqtt_client.on_disconnect = on_disconnect
     
     # Set last will
-    last_will = {
-        'status': 'offline',
-        'tower': TOWER_NAME,
-        'camera': CAMERA_TYPE
-    }
-    mqtt_client.will_set(MQTT_TOPIC_STATUS, json.dumps(last_will), retain=True)
+    mqtt_client.will_set(MQTT_TOPIC_STATUS, payload=STATUS_OFFLINE_BYTES, retain=True)
     
     try:
         mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
@@ -110,9 +173,106 @@ def setup_mqtt():
         return False
 
 
+def build_publish_frame(topic, payload):
+    """Build a complete MQTT 3.1.1 PUBLISH packet (QoS 0, retained)"""
+    topic = topic.encode()
+    body = struct.pack('!H', len(topic)) + topic + payload
+    
+    # Remaining length is a base-128 varint
+    remaining = len(body)
+    header = bytearray([0x31])
+    while True:
+        byte, remaining = remaining % 128, remaining // 128
+        header.append(byte | 0x80 if remaining else byte)
+        if not remaining:
+            break
+    
+    return bytes(header) + body
+
+
+def paho_output_idle():
+    """True when paho has no queued or partly written packet to send"""
+    with mqtt_client._out_packet_mutex:
+        return not mqtt_client._out_packet
+
+
+def publish_status(payload):
+    """Publish a retained QoS 0 status payload from a cached frame
+    
+    Writes straight to paho's socket, so only call this when paho is not
+    writing concurrently: from its own callbacks or after loop_stop().
+    The raw path is only taken while paho's outgoing queue is empty, and
+    falls back to a regular publish if nothing could be written. Once part
+    of the frame is on the wire there is no fallback: the frame is either
+    finished or the connection is dropped so paho reconnects cleanly.
+    """
+    frame = status_frames.get(payload)
+    if frame is None:
+        frame = status_frames[payload] = build_publish_frame(MQTT_TOPIC_STATUS, payload)
+    
+    sock = mqtt_client.socket()
+    if sock is None or not paho_output_idle():
+        mqtt_client.publish(MQTT_TOPIC_STATUS, payload=payload, retain=True)
+        return
+    
+    # paho's socket is non-blocking, so send() may write only part of it
+    view = memoryview(frame)
+    sent = 0
+    deadline = time.monotonic() + STATUS_SEND_TIMEOUT_SECONDS
+    try:
+        while sent < len(view):
+            try:
+                sent += sock.send(view[sent:])
+            except BlockingIOError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("MQTT socket not writable")
+                select.select([], [sock], [], remaining)
+    except OSError:
+        if not sent:
+            mqtt_client.publish(MQTT_TOPIC_STATUS, payload=payload, retain=True)
+            return
+        # Half a frame is on the wire; the stream is unusable from here
+        print("Status publish interrupted, dropping MQTT connection")
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class SingleFrameOutput(Output):
+    """Encoder output that writes the first JPEG frame to a file"""
+    
+    def __init__(self):
+        super().__init__()
+        self.filepath = None
+        self.done = threading.Event()
+    
+    def arm(self, filepath):
+        """Prepare to write the next frame to filepath"""
+        self.filepath = filepath
+        self.done.clear()
+    
+    def outputframe(self, frame, *args, **kwargs):
+        if self.done.is_set() or self.filepath is None:
+            return
+        with open(self.filepath, 'wb') as f:
+            f.write(frame)
+        self.done.set()
+
+
+def encoder_quality(jpeg_quality):
+    """Map a 0-100 JPEG quality onto picamera2's encoder Quality levels"""
+    for threshold, level in ((90, Quality.VERY_HIGH), (80, Quality.HIGH),
+                             (65, Quality.MEDIUM), (50, Quality.LOW)):
+        if jpeg_quality >= threshold:
+            return level
+    return Quality.VERY_LOW
+
+
 def setup_camera():
     """Initialize Raspberry Pi NOIR Camera"""
-    global camera
+    global camera, jpeg_encoder, jpeg_output, jpeg_quality
     
     if Picamera2 is None:
         print("Camera not available (running in mock mode)")
@@ -125,6 +285,7 @@ def setup_camera():
         # Disable AWB for IR imaging, use manual controls
         config = camera.create_still_configuration(
             main={"size": (IMAGE_WIDTH, IMAGE_HEIGHT)},
+            encode="main",
             controls={
                 "AfMode": controls.AfModeEnum.Continuous,
                 "AeEnable": True,
@@ -135,12 +296,20 @@ def setup_camera():
             }
         )
         camera.configure(config)
+        camera.options["quality"] = IMAGE_QUALITY
         camera.start()
         
+        # Encoder and output are reused for every capture
+        if MJPEGEncoder:
+            jpeg_encoder = MJPEGEncoder()
+            jpeg_output = SingleFrameOutput()
+            jpeg_quality = encoder_quality(IMAGE_QUALITY)
+        
         # Allow camera to warm up
         time.sleep(2)
         
-        print("NOIR camera initialized successfully")
+        print(f"NOIR camera initialized successfully "
+              f"({'hardware' if jpeg_encoder else 'software'} JPEG encode)")
         return True
         
     except Exception as e:
@@ -148,55 +317,149 @@ def setup_camera():
         return False
 
 
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    """Serve captured images at /img/<filename> straight from disk"""
+    
+    def do_GET(self):
+        if not self.path.startswith('/img/'):
+            self.send_error(404)
+            return
+        
+        # Only serve plain filenames from the image directory
+        filepath = IMAGE_DIR / Path(self.path[len('/img/'):]).name
+        if not filepath.is_file():
+            self.send_error(404)
+            return
+        
+        with open(filepath, 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            self.wfile.flush()
+            # Kernel-side copy (os.sendfile) from file to socket
+            self.connection.sendfile(f)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def setup_image_server():
+    """Start HTTP server for image file transfer to RPi5"""
+    global image_server
+    
+    try:
+        image_server = ThreadingHTTPServer(('0.0.0.0', IMAGE_SERVER_PORT), ImageRequestHandler)
+        image_server.daemon_threads = True
+        threading.Thread(target=image_server.serve_forever, daemon=True).start()
+        print(f"Image server listening on port {IMAGE_SERVER_PORT}")
+        return True
+    except Exception as e:
+        print(f"Error starting image server: {e}")
+        return False
+
+
+def grab_frame(filepath):
+    """Run the camera capture (camera thread only)"""
+    if jpeg_encoder:
+        # Encode one frame on the VC4 JPEG block, no CPU encode
+        jpeg_output.arm(filepath)
+        camera.start_encoder(jpeg_encoder, jpeg_output, quality=jpeg_quality)
+        try:
+            if not jpeg_output.done.wait(ENCODE_TIMEOUT_SECONDS):
+                raise RuntimeError("timed out waiting for hardware JPEG frame")
+        finally:
+            camera.stop_encoder()
+        return None
+    
+    # Grab the frame buffer; encoding happens on the save worker
+    return camera.capture_request()
+
+
 def capture_image():
-    """Capture IR image from NOIR camera"""
+    """Capture IR image from NOIR camera and queue it for saving"""
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"{TOWER_NAME}_{CAMERA_TYPE}_{timestamp}.jpg"
-    filepath = IMAGE_DIR / filename
+    # Written under a temporary name; the save worker renames it once complete
+    filepath = IMAGE_DIR / f"{TOWER_NAME}_{CAMERA_TYPE}_{timestamp}.jpg.tmp"
     
     try:
         if camera:
-            # Capture image
-            camera.capture_file(str(filepath))
+            request = camera_pool.submit(grab_frame, filepath).result(timeout=CAPTURE_TIMEOUT_SECONDS)
             print(f"Captured IR image: {filepath}")
-            
-            # Get file size
-            file_size = filepath.stat().st_size
-            
-            return filepath, file_size
         else:
             # Mock mode - create placeholder
             print(f"Mock capture: {filepath}")
             with open(filepath, 'w') as f:
                 f.write("Mock IR image data")
-            return filepath, 100
+            request = None
+        
+        save_queue.put((request, filepath))
+        return filepath
             
     except Exception as e:
         print(f"Error capturing IR image: {e}")
-        return None, 0
+        return None
+
+
+def save_worker():
+    """Encode and write queued captures, then publish their metadata"""
+    while True:
+        item = save_queue.get()
+        if item is None:
+            break
+        
+        request, tmp_path = item
+        try:
+            if request:
+                try:
+                    request.save("main", str(tmp_path), format='jpeg')
+                finally:
+                    request.release()
+            
+            filepath, sha256 = finalize_image(tmp_path)
+            send_image_mqtt(filepath, filepath.stat().st_size, sha256)
+        except Exception as e:
+            print(f"Error saving IR image {tmp_path.name}: {e}")
+
 
+def finalize_image(tmp_path):
+    """Atomically rename a finished capture to its content-addressed name"""
+    with open(tmp_path, 'rb') as f:
+        sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+    
+    # <tower>_noir_<timestamp>_<sha prefix>.jpg
+    stem = tmp_path.name[:-len('.jpg.tmp')]
+    filepath = tmp_path.with_name(f"{stem}_{sha256[:16]}.jpg")
+    os.replace(tmp_path, filepath)
+    
+    return filepath, sha256
+
+
+def setup_save_worker():
+    """Start the background image save thread"""
+    global save_thread
+    
+    save_thread = threading.Thread(target=save_worker, daemon=True)
+    save_thread.start()
 
-def send_image_mqtt(filepath, file_size):
+
+def send_image_mqtt(filepath, file_size, sha256):
     """Send IR image metadata to RPi5 via MQTT"""
     try:
-        metadata = {
-            'tower': TOWER_NAME,
-            'camera_type': CAMERA_TYPE,
+        metadata = METADATA_PREFIX + json_dumps({
             'filename': filepath.name,
             'filepath': str(filepath),
             'file_size': file_size,
+            'sha256': sha256,
             'timestamp': datetime.now().isoformat(),
-            'width': IMAGE_WIDTH,
-            'height': IMAGE_HEIGHT,
-            'spectrum': 'near_infrared'
-        }
+            'url': f"http://{get_ip_address()}:{IMAGE_SERVER_PORT}/img/{filepath.name}"
+        })[1:]
         
         # Publish metadata
-        mqtt_client.publish(MQTT_TOPIC_IMAGE, json.dumps(metadata), qos=1)
+        mqtt_client.publish(MQTT_TOPIC_IMAGE, payload=metadata, qos=1)
         print(f"Sent IR image metadata via MQTT: {filepath.name}")
         
-        # Note: Actual image file should be accessed via network share
-        # or transferred via separate mechanism (rsync, sftp, etc.)
+        # Image bytes are pulled by the RPi5 over HTTP from the metadata url
         
         return True
         
@@ -205,42 +468,74 @@ def send_image_mqtt(filepath, file_size):
         return False
 
 
-def is_lights_on():
+def is_lights_on(now=None):
     """Check if grow lights should be on based on schedule"""
-    current_hour = datetime.now().hour
+    current_hour = ((int(now or time.time()) + TZ_OFFSET_SECONDS) // 3600) % 24
     return LIGHTS_ON_HOUR <= current_hour < LIGHTS_OFF_HOUR
 
 
+def seconds_until_next_capture(last_capture_time):
+    """Seconds until the next scheduled capture, deferred to lights-on hours"""
+    global TZ_OFFSET_SECONDS
+    
+    now = time.time()
+    TZ_OFFSET_SECONDS = time.localtime(now).tm_gmtoff
+    next_capture = max(last_capture_time + CAPTURE_INTERVAL_HOURS * 3600, now)
+    
+    if not is_lights_on(next_capture):
+        # Push the capture to the next lights-on time (today or tomorrow)
+        next_dt = datetime.fromtimestamp(next_capture)
+        lights_on = next_dt.replace(hour=LIGHTS_ON_HOUR, minute=0, second=0, microsecond=0)
+        if next_dt.hour >= LIGHTS_OFF_HOUR:
+            lights_on += timedelta(days=1)
+        next_capture = lights_on.timestamp()
+    
+    return max(1, next_capture - now)
+
+
 def get_ip_address():
-    """Get local IP address"""
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except:
-        return "unknown"
+    """Get local IP address from the network interface (cached)"""
+    global ip_address
+    
+    if ip_address:
+        return ip_address
+    
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for iface in NETWORK_INTERFACES:
+            try:
+                packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack('256s', iface.encode()[:15]))
+                ip_address = socket.inet_ntoa(packed[20:24])
+                return ip_address
+            except OSError:
+                continue
+    
+    return "unknown"
 
 
 def cleanup():
     """Cleanup resources"""
-    global camera, mqtt_client
+    global camera, mqtt_client, image_server, save_thread
     
     print("\nShutting down...")
     
+    if image_server:
+        image_server.shutdown()
+        image_server.server_close()
+    
+    # Let queued captures finish before the camera goes away
+    if save_thread:
+        save_queue.put(None)
+        save_thread.join(timeout=30)
+    
+    camera_pool.shutdown(wait=True)
+    
     if camera and Picamera2:
         camera.stop()
         camera.close()
     
     if mqtt_client:
-        status = {
-            'status': 'offline',
-            'tower': TOWER_NAME,
-            'camera': CAMERA_TYPE
-        }
-        mqtt_client.publish(MQTT_TOPIC_STATUS, json.dumps(status), retain=True)
         mqtt_client.loop_stop()
+        publish_status(STATUS_OFFLINE_BYTES)
         mqtt_client.disconnect()
     
     print("Cleanup complete")
@@ -264,35 +559,27 @@ def main():
     if not setup_camera():
         print("Warning: NOIR camera setup failed. Running in mock mode.")
     
+    setup_save_worker()
+    
+    if not setup_image_server():
+        print("Warning: Image server failed to start. Images must be fetched manually.")
+    
     try:
         last_capture_time = 0
-        capture_interval_seconds = CAPTURE_INTERVAL_HOURS * 3600
         
         while True:
-            current_time = time.time()
+            # Sleep straight through to the next capture slot; MQTT keepalive
+            # runs in paho's own thread via loop_start()
+            time.sleep(seconds_until_next_capture(last_capture_time))
             
-            # Check if it's time to capture
-            if current_time - last_capture_time >= capture_interval_seconds:
-                
-                # Only capture during lights-on hours
-                if is_lights_on():
-                    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]")
-                    print("Capturing IR image...")
-                    
-                    filepath, file_size = capture_image()
-                    
-                    if filepath and file_size > 0:
-                        send_image_mqtt(filepath, file_size)
-                        last_capture_time = current_time
-                    else:
-                        print("IR image capture failed")
-                else:
-                    print(f"Lights off (current hour: {datetime.now().hour}). Skipping capture.")
-                    # Still update last capture time to avoid immediate retry
-                    last_capture_time = current_time
+            print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]")
+            print("Capturing IR image...")
             
-            # MQTT keepalive
-            time.sleep(60)  # Check every minute
+            if capture_image():
+                last_capture_time = time.time()
+            else:
+                print(f"IR image capture failed. Retrying in {CAPTURE_RETRY_SECONDS} seconds.")
+                time.sleep(CAPTURE_RETRY_SECONDS)
             
     except KeyboardInterrupt:
         print("\nReceived interrupt signal")
@@ -13,15 +13,33 @@ Features:
 """
 
 import os
-import json
+import re
+import math
+import asyncio
 import logging
+import threading
+from collections import deque
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from paho.mqtt.subscribeoptions import SubscribeOptions
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 from flask_ask import Ask, statement, question
 import requests
+import orjson
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from hypercorn.middleware import AsyncioWSGIMiddleware
+
+# libuv-backed event loop for MQTT + HTTP; stock asyncio works without it
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 logging.basicConfig(
     level=logging.INFO,
@@ -35,32 +53,114 @@ load_dotenv()
 app = Flask(__name__)
 ask = Ask(app, "/")
 
+# MQTT inbox batching
+BATCH_LATENCY_MS = 50
+BATCH_MAX_MESSAGES = 200
+
+# MQTT v5 session settings
+MQTT_TOPIC_ALIAS_MAXIMUM = 16
+MQTT_SESSION_EXPIRY_SECONDS = 300
+
+# Seconds between paho housekeeping calls (keepalive pings, reconnects)
+MQTT_MISC_INTERVAL = 1.0
+
+# Sensor readings, one float32 row per tower (NaN = no reading yet)
+TOWERS = ("cool", "warm")
+SENSORS = ("ph", "ec", "water_temp", "air_temp", "air_humidity", "vpd")
+TOWER_INDEX = {tower: i for i, tower in enumerate(TOWERS)}
+SENSOR_INDEX = {sensor: i for i, sensor in enumerate(SENSORS)}
+
+sensor_values = np.full((len(TOWERS), len(SENSORS)), np.nan, dtype=np.float32)
+
+# Topic routing: exact lookup for the fixed sensor topics, one regex for the rest
+SENSOR_TOPICS = {
+    f"/{tower}/{sensor}": (TOWER_INDEX[tower], SENSOR_INDEX[sensor])
+    for tower in TOWERS for sensor in SENSORS
+}
+TOPIC_RE = re.compile(
+    r'^(?:/alerts/(?:[^/]*/)*([^/]*)'
+    r'|/events/(?:[^/]*/)*([^/]*)'
+    r'|(homeassistant/person/[^/]+/state))$'
+)
+
+class TowerStatus(NamedTuple):
+    """Non-sensor tower state (sensor readings live in sensor_values)"""
+    plant_count: int = 0
+    health: str = "unknown"
+
 # Global state
 system_status = {
-    "cool": {
-        "ph": None,
-        "ec": None,
-        "water_temp": None,
-        "air_temp": None,
-        "air_humidity": None,
-        "vpd": None,
-        "plant_count": 0,
-        "health": "unknown"
-    },
-    "warm": {
-        "ph": None,
-        "ec": None,
-        "water_temp": None,
-        "air_temp": None,
-        "air_humidity": None,
-        "vpd": None,
-        "plant_count": 0,
-        "health": "unknown"
-    },
+    "cool": TowerStatus(),
+    "warm": TowerStatus(),
     "last_alert": None,
     "harvest_ready": []
 }
 
+def build_status_view() -> Dict:
+    """Nested dict view of system status (sensor readings merged per tower)"""
+    view = dict(system_status)
+    for tower, row in zip(TOWERS, sensor_values.tolist()):
+        # float32 storage; round off the widening noise for display
+        readings = {
+            sensor: None if math.isnan(value) else round(value, 4)
+            for sensor, value in zip(SENSORS, row)
+        }
+        view[tower] = {**readings, **system_status[tower]._asdict()}
+    return view
+
+# Voice announcement text per alert type
+ALERT_TEMPLATES = {
+    "ph": "Critical pH alert in {tower} tower. Current pH is {value}.",
+    "ec": "Critical EC alert in {tower} tower. Current EC is {value}.",
+    "temperature": "Temperature alert in {tower} tower. Current temperature is {value} degrees.",
+    "vpd": "VPD alert in {tower} tower. Current VPD is {vpd} kilopascals.",
+    "deficiency": "{deficiency} deficiency detected in {tower} tower."
+}
+
+class _AnnouncementFields(dict):
+    """Alert payload with announcement defaults for missing fields"""
+    
+    def __missing__(self, key):
+        if key == "tower":
+            return ""
+        if key == "deficiency":
+            return "nutrient"
+        return "unknown"
+
+class AsyncioMQTTHelper:
+    """Drive a paho client from an asyncio event loop instead of loop_start()"""
+    
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client):
+        self.loop = loop
+        self.client = client
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+    
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.add_reader, sock, client.loop_read)
+    
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.remove_reader, sock)
+    
+    def on_socket_register_write(self, client, userdata, sock):
+        # Publishes may come from Flask worker threads
+        self.loop.call_soon_threadsafe(self.loop.add_writer, sock, client.loop_write)
+    
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.remove_writer, sock)
+    
+    async def misc_loop(self):
+        """Keepalive and reconnect handling normally done by loop_start()"""
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    self.client.reconnect()
+                except Exception as e:
+                    logger.error("MQTT reconnect failed: %s", e)
+            await asyncio.sleep(MQTT_MISC_INTERVAL)
+
 class AlexaIntegration:
     def __init__(self):
         # MQTT Configuration
@@ -68,90 +168,141 @@ class AlexaIntegration:
         self.port = int(os.getenv("MQTT_PORT", 1883))
         self.username = os.getenv("MQTT_USERNAME", "hydro_user")
         self.password = os.getenv("MQTT_PASSWORD", "")
+        self.client_id = os.getenv("ALEXA_MQTT_CLIENT_ID", "alexa_integration")
+        
+        # Optional shared-subscription group for running several instances
+        self.share_group = os.getenv("ALEXA_MQTT_SHARE_GROUP", "")
         
         # Home Assistant Configuration
         self.ha_enabled = os.getenv("ENABLE_HOME_ASSISTANT", "true").lower() == "true"
         self.ha_arrival_delay = int(os.getenv("HA_ARRIVAL_DELAY_MINUTES", 5))
         
-        # MQTT client
-        self.client = mqtt.Client()
+        # MQTT client (v5 for topic aliases)
+        self.client = mqtt.Client(client_id=self.client_id, protocol=mqtt.MQTTv5)
         self.client.username_pw_set(self.username, self.password)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         
+        # Inbound topic alias -> topic name, reset on every connection
+        self.topic_aliases = {}
+        
         # Important announcements queue
         self.announcements = []
         
+        # Incoming MQTT messages, drained in batches on the event loop
+        self.inbox = deque()
+        self.status_lock = threading.Lock()
+        self.mqtt_helper = None
+        
         logger.info("Alexa Integration initialized")
     
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         """MQTT connection handler"""
         if rc == 0:
             logger.info("Connected to MQTT broker")
+            self.topic_aliases.clear()
             
-            # Subscribe to all sensor topics
-            client.subscribe("/+/ph")
-            client.subscribe("/+/ec")
-            client.subscribe("/+/water_temp")
-            client.subscribe("/+/air_temp")
-            client.subscribe("/+/air_humidity")
-            client.subscribe("/+/vpd")
-            
-            # Subscribe to alerts and events
-            client.subscribe("/alerts/#")
-            client.subscribe("/events/#")
+            # All sensor topics, alerts and events
+            topics = [
+                "/+/ph",
+                "/+/ec",
+                "/+/water_temp",
+                "/+/air_temp",
+                "/+/air_humidity",
+                "/+/vpd",
+                "/alerts/#",
+                "/events/#"
+            ]
             
-            # Subscribe to Home Assistant topics
+            # Home Assistant topics
             if self.ha_enabled:
-                client.subscribe("homeassistant/person/+/state")
+                topics.append("homeassistant/person/+/state")
+            
+            if self.share_group:
+                topics = [f"$share/{self.share_group}/{topic}" for topic in topics]
+            
+            options = SubscribeOptions(qos=0, retainAsPublished=True)
+            client.subscribe([(topic, options) for topic in topics])
         else:
-            logger.error(f"MQTT connection failed: {rc}")
+            logger.error("MQTT connection failed: %s", rc)
     
     def on_message(self, client, userdata, msg):
-        """MQTT message handler"""
-        global system_status
+        """MQTT message handler - queue for the drain task"""
+        topic = msg.topic
         
-        try:
-            topic = msg.topic
+        # Resolve broker-assigned topic aliases (paho leaves this to the app)
+        alias = getattr(msg.properties, "TopicAlias", None)
+        if alias:
+            if topic:
+                self.topic_aliases[alias] = topic
+            else:
+                topic = self.topic_aliases.get(alias, "")
+        
+        self.inbox.append((topic, msg.payload))
+    
+    async def _drain(self):
+        """Process queued MQTT messages in batches"""
+        while True:
+            await asyncio.sleep(BATCH_LATENCY_MS / 1000)
+            
+            batch = []
+            while self.inbox and len(batch) < BATCH_MAX_MESSAGES:
+                batch.append(self.inbox.popleft())
+            
+            if batch:
+                self.process_batch(batch)
+    
+    def process_batch(self, batch: List):
+        """Apply a batch of (topic, payload) messages"""
+        # Sensor readings are last-write-wins per (tower, sensor)
+        sensor_updates = {}
+        trace = logger.isEnabledFor(logging.DEBUG)
+        
+        for topic, payload in batch:
+            if trace:
+                logger.debug("MQTT message %s %r", topic, payload[:32])
             
             # Update sensor readings
-            if topic.count('/') == 1:
-                parts = topic.strip('/').split('/')
-                tower = parts[0]
-                sensor = parts[1]
-                
-                if tower in ["cool", "warm"]:
-                    try:
-                        value = float(msg.payload.decode())
-                        system_status[tower][sensor] = value
-                    except:
-                        pass
+            index = SENSOR_TOPICS.get(topic)
+            if index:
+                sensor_updates[index] = payload
+                continue
             
-            # Handle alerts
-            elif topic.startswith("/alerts/"):
-                alert_type = topic.split('/')[-1]
-                payload = json.loads(msg.payload.decode())
-                
-                self.handle_alert(alert_type, payload)
+            match = TOPIC_RE.match(topic)
+            if not match:
+                continue
+            alert_type, event_type, person_topic = match.groups()
             
-            # Handle events
-            elif topic.startswith("/events/"):
-                event_type = topic.split('/')[-1]
-                payload = json.loads(msg.payload.decode())
+            try:
+                # Handle alerts
+                if alert_type is not None:
+                    self.handle_alert(alert_type, orjson.loads(payload))
+                
+                # Handle events
+                elif event_type is not None:
+                    if event_type == "harvest":
+                        self.announce_harvest(orjson.loads(payload))
                 
-                if event_type == "harvest":
-                    self.announce_harvest(payload)
+                # Handle Home Assistant person tracking
+                elif self.ha_enabled:
+                    # Check if user just arrived home
+                    state = payload.decode()
+                    if state == "home":
+                        # Schedule announcement after delay
+                        self.schedule_arrival_announcement()
             
-            # Handle Home Assistant person tracking
-            elif "homeassistant/person/" in topic and self.ha_enabled:
-                # Check if user just arrived home
-                state = msg.payload.decode()
-                if state == "home":
-                    # Schedule announcement after delay
-                    self.schedule_arrival_announcement()
+            except Exception as e:
+                logger.error("Error processing message: %s", e)
         
-        except Exception as e:
-            logger.error(f"Error processing message: {e}")
+        if not sensor_updates:
+            return
+        
+        with self.status_lock:
+            for index, payload in sensor_updates.items():
+                try:
+                    sensor_values[index] = float(payload)
+                except:
+                    pass
     
     def handle_alert(self, alert_type: str, payload: Dict):
         """Process alerts and queue announcements"""
@@ -178,26 +329,11 @@ class AlexaIntegration:
     
     def create_alert_announcement(self, alert_type: str, payload: Dict) -> str:
         """Create voice announcement text"""
-        tower = payload.get("tower", "")
-        
-        if alert_type == "ph":
-            return f"Critical pH alert in {tower} tower. Current pH is {payload.get('value', 'unknown')}."
-        
-        elif alert_type == "ec":
-            return f"Critical EC alert in {tower} tower. Current EC is {payload.get('value', 'unknown')}."
-        
-        elif alert_type == "temperature":
-            return f"Temperature alert in {tower} tower. Current temperature is {payload.get('value', 'unknown')} degrees."
+        template = ALERT_TEMPLATES.get(alert_type)
+        if template:
+            return template.format_map(_AnnouncementFields(payload))
         
-        elif alert_type == "vpd":
-            return f"VPD alert in {tower} tower. Current VPD is {payload.get('vpd', 'unknown')} kilopascals."
-        
-        elif alert_type == "deficiency":
-            deficiency = payload.get("deficiency", "nutrient")
-            return f"{deficiency} deficiency detected in {tower} tower."
-        
-        else:
-            return f"Alert in {tower} tower: {alert_type}"
+        return f"Alert in {payload.get('tower', '')} tower: {alert_type}"
     
     def announce_harvest(self, payload: Dict):
         """Announce harvest completion"""
@@ -217,14 +353,14 @@ class AlexaIntegration:
         # This would be implemented with a timer
         # For now, just add to queue
         if self.announcements:
-            logger.info(f"User arrived home - {len(self.announcements)} announcements pending")
+            logger.info("User arrived home - %d announcements pending", len(self.announcements))
     
     def send_ha_notification(self, message: str):
         """Send notification via Home Assistant"""
         # Publish to Home Assistant MQTT
         self.client.publish(
             "homeassistant/notify/alexa",
-            json.dumps({
+            orjson.dumps({
                 "message": message,
                 "target": "Echo Show 21",
                 "data": {
@@ -235,36 +371,39 @@ class AlexaIntegration:
     
     def get_status_summary(self, tower: str) -> str:
         """Get voice-friendly status summary"""
-        global system_status
-        
-        status = system_status.get(tower, {})
-        
-        ph = status.get("ph")
-        ec = status.get("ec")
-        temp = status.get("water_temp")
-        vpd = status.get("vpd")
+        ph, ec, temp, _, _, vpd = sensor_values[TOWER_INDEX[tower]].tolist()
         
         summary = f"{tower.capitalize()} tower status: "
         
-        if ph:
+        # NaN (no reading) and zero are both skipped
+        if ph and not math.isnan(ph):
             summary += f"pH is {ph:.1f}, "
-        if ec:
+        if ec and not math.isnan(ec):
             summary += f"EC is {ec:.1f}, "
-        if temp:
+        if temp and not math.isnan(temp):
             summary += f"water temperature is {temp:.0f} degrees, "
-        if vpd:
+        if vpd and not math.isnan(vpd):
             summary += f"VPD is {vpd:.2f}."
         
         return summary
     
-    def run(self):
-        """Start MQTT listener"""
+    async def run(self):
+        """Start MQTT listener on the running event loop"""
+        loop = asyncio.get_running_loop()
+        self.mqtt_helper = AsyncioMQTTHelper(loop, self.client)
+        
+        loop.create_task(self.mqtt_helper.misc_loop())
+        loop.create_task(self._drain())
+        
         try:
             logger.info("Starting Alexa Integration...")
-            self.client.connect(self.broker, self.port, 60)
-            self.client.loop_start()
+            properties = Properties(PacketTypes.CONNECT)
+            properties.TopicAliasMaximum = MQTT_TOPIC_ALIAS_MAXIMUM
+            properties.SessionExpiryInterval = MQTT_SESSION_EXPIRY_SECONDS
+            self.client.connect(self.broker, self.port, 60,
+                                clean_start=False, properties=properties)
         except Exception as e:
-            logger.error(f"Error starting MQTT: {e}")
+            logger.error("Error starting MQTT: %s", e)
 
 # Create global instance
 alexa_integration = AlexaIntegration()
@@ -329,7 +468,7 @@ def get_plant_count(tower):
         return statement("I can only check the cool or warm tower.")
     
     # This would query the plant tracker
-    count = system_status[tower_name].get("plant_count", 0)
+    count = system_status[tower_name].plant_count
     return statement(f"The {tower} tower has {count} active plants.")
 
 @ask.intent("HarvestReadyIntent")
@@ -374,21 +513,32 @@ def dashboard():
     """Return visual dashboard data for Echo Show 21"""
     global system_status
     
-    return jsonify({
+    return Response(orjson.dumps({
         "version": "1.0",
-        "status": system_status,
+        "status": build_status_view(),
         "timestamp": datetime.now().isoformat(),
         "announcements": alexa_integration.announcements
-    })
+    }), mimetype="application/json")
 
-def main():
-    """Main entry point"""
+async def serve_all():
+    """Run MQTT and the Alexa Skill HTTP server on one event loop"""
     # Start MQTT integration
-    alexa_integration.run()
+    await alexa_integration.run()
     
     # Start Flask app for Alexa Skill
     port = int(os.getenv("ALEXA_SKILL_PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=False)
+    config = Config()
+    config.bind = [f"0.0.0.0:{port}"]
+    await serve(AsyncioWSGIMiddleware(app), config)
+
+def main():
+    """Main entry point"""
+    if uvloop:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    else:
+        logger.warning("uvloop not installed - using default asyncio event loop")
+    
+    asyncio.run(serve_all())
 
 if __name__ == "__main__":
     main()
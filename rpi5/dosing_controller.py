@@ -18,43 +18,81 @@ Safety Features:
 """
 
 import os
-import json
 import logging
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-import paho.mqtt.client as mqtt
-from dotenv import load_dotenv
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from functools import lru_cache, partial
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import orjson
 import time
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from mqtt_singleton import add_connect_handler, get_client, load_environment
+
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+# Controller availability, cleared by the broker (LWT) if we drop off
+STATUS_TOPIC = "/status/dosing"
+
+# How many recent dose_id tokens to remember for duplicate rejection
+RECENT_DOSE_IDS_MAX = 256
+
+# Rows per page returned by get_dose_history
+DOSE_HISTORY_PAGE_SIZE = 1000
+
+@dataclass(frozen=True, slots=True)
+class DosingConfig:
+    """Dosing settings parsed from the environment"""
+    reservoir_gal: float
+    pump_ml_s: float
+    max_dose_day_ml: float
+    auto: bool
+    concentrations: Tuple[Tuple[str, float], ...]  # (solution, g/L)
+    broker: str
+    port: int
+    username: str
+    password: str
+
+@lru_cache(maxsize=1)
+def load_config() -> DosingConfig:
+    """Parse dosing settings from the environment (once per process)"""
+    return DosingConfig(
+        reservoir_gal=float(os.getenv("RESERVOIR_VOLUME_GALLONS", 5)),
+        pump_ml_s=float(os.getenv("PUMP_ML_PER_SECOND", 1.0)),
+        max_dose_day_ml=float(os.getenv("MAX_DOSE_ML_PER_DAY", 100)),
+        auto=os.getenv("ENABLE_AUTO_DOSING", "false").lower() == "true",
+        concentrations=(
+            ("epsom_salt", float(os.getenv("EPSOM_SALT_CONCENTRATION", 100))),
+            ("calcium_nitrate", float(os.getenv("CALCIUM_NITRATE_CONCENTRATION", 150))),
+            ("potassium_bicarbonate", float(os.getenv("POTASSIUM_BICARBONATE_CONCENTRATION", 50))),
+            ("ph_down", float(os.getenv("PH_DOWN_CONCENTRATION", 10)))
+        ),
+        broker=os.getenv("MQTT_BROKER", "10.0.0.62"),
+        port=int(os.getenv("MQTT_PORT", 1883)),
+        username=os.getenv("MQTT_USERNAME", "hydro_user"),
+        password=os.getenv("MQTT_PASSWORD", "")
+    )
 
 class DosingController:
-    def __init__(self, db_path="/home/pi/hydro_data/dosing.db"):
+    def __init__(self, db_path="/home/pi/hydro_data/dosing.db", client=None):
         self.db_path = db_path
+        self.cfg = load_config()
         
         # Reservoir configuration
-        self.reservoir_volume_gallons = float(os.getenv("RESERVOIR_VOLUME_GALLONS", 5))
+        self.reservoir_volume_gallons = self.cfg.reservoir_gal
         self.reservoir_volume_liters = self.reservoir_volume_gallons * 3.78541
         
         # Pump configuration
-        self.pump_ml_per_second = float(os.getenv("PUMP_ML_PER_SECOND", 1.0))
-        self.max_dose_ml_per_day = float(os.getenv("MAX_DOSE_ML_PER_DAY", 100))
-        self.auto_dosing_enabled = os.getenv("ENABLE_AUTO_DOSING", "false").lower() == "true"
+        self.pump_ml_per_second = self.cfg.pump_ml_s
+        self.max_dose_ml_per_day = self.cfg.max_dose_day_ml
+        self.auto_dosing_enabled = self.cfg.auto
         
         # Solution concentrations (g/L)
-        self.concentrations = {
-            "epsom_salt": float(os.getenv("EPSOM_SALT_CONCENTRATION", 100)),
-            "calcium_nitrate": float(os.getenv("CALCIUM_NITRATE_CONCENTRATION", 150)),
-            "potassium_bicarbonate": float(os.getenv("POTASSIUM_BICARBONATE_CONCENTRATION", 50)),
-            "ph_down": float(os.getenv("PH_DOWN_CONCENTRATION", 10))
-        }
+        self.concentrations = dict(self.cfg.concentrations)
         
         # Pump GPIO pins (to be set on ESP32)
         self.pump_pins = {
@@ -72,56 +110,151 @@ class DosingController:
             }
         }
         
-        # Current tower sensor readings
-        self.tower_status = {
-            "cool": {"ph": None, "ec": None, "temp": None},
-            "warm": {"ph": None, "ec": None, "temp": None}
+        # Flat lookups for the dose path
+        self._pump_pin = {
+            (tower, solution): pin
+            for tower, pins in self.pump_pins.items()
+            for solution, pin in pins.items()
         }
+        self._ml_to_sec = 1.0 / self.pump_ml_per_second
+        self._cmd_topic = {tower: f"/{tower}/pump/command" for tower in self.pump_pins}
+        
+        # Current tower sensor readings, one float32 slot per tower (NaN = no reading yet)
+        self._tidx = {"cool": 0, "warm": 1}
+        self._ph = np.full(len(self._tidx), np.nan, dtype=np.float32)
+        self._ec = np.full(len(self._tidx), np.nan, dtype=np.float32)
+        self._temp = np.full(len(self._tidx), np.nan, dtype=np.float32)
+        
+        # Running dose totals for today: (tower, solution) -> (day, total_ml)
+        self._daily_totals = {}
+        
+        # Doses waiting on pump run + mixing: (tower, solution) -> volume_ml
+        self._pending_doses = {}
+        self._pending_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="dose")
+        
+        # Recently handled dose_id tokens (dose_id -> time seen), oldest first
+        self._recent_doses = OrderedDict()
         
         # MQTT Configuration
-        self.broker = os.getenv("MQTT_BROKER", "10.0.0.62")
-        self.port = int(os.getenv("MQTT_PORT", 1883))
-        self.username = os.getenv("MQTT_USERNAME", "hydro_user")
-        self.password = os.getenv("MQTT_PASSWORD", "")
+        self.broker = self.cfg.broker
+        self.port = self.cfg.port
+        self.username = self.cfg.username
+        self.password = self.cfg.password
         
         # Initialize database
         self._init_database()
         
-        # MQTT client
-        self.client = mqtt.Client()
-        self.client.username_pw_set(self.username, self.password)
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
+        # MQTT client, shared with any other service in this process
+        self.client = client or get_client()
+        add_connect_handler(self.client, self.on_connect)
+        self.client.will_set(STATUS_TOPIC, "offline", retain=True)
+        
+        # Each fixed sensor topic gets its own handler with the tower bound in
+        for tower in self._tidx:
+            self.client.message_callback_add(f"/{tower}/ph", partial(self._on_ph, tower))
+            self.client.message_callback_add(f"/{tower}/ec", partial(self._on_ec, tower))
+            self.client.message_callback_add(
+                f"/{tower}/water_temp", partial(self._on_water_temp, tower)
+            )
+        self.client.message_callback_add("/dosing/+/command", self._on_dosing_command)
+        self.client.message_callback_add("/alerts/deficiency", self._on_deficiency)
         
         logger.info("Dosing Controller initialized")
     
+    @property
+    def tower_status(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """Current readings per tower as a nested dict (None = no reading yet)"""
+        return {
+            tower: {
+                "ph": self._reading(self._ph, tower),
+                "ec": self._reading(self._ec, tower),
+                "temp": self._reading(self._temp, tower)
+            }
+            for tower in self._tidx
+        }
+    
+    def _reading(self, values: np.ndarray, tower: str) -> Optional[float]:
+        """One tower's reading as a plain float, or None if not yet received"""
+        value = float(values[self._tidx[tower]])
+        if np.isnan(value):
+            return None
+        # float32 storage; round off the widening noise
+        return round(value, 4)
+    
     def _init_database(self):
         """Initialize dosing history database"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # One long-lived connection, shared with the MQTT network thread
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
         
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        
+        cursor.execute("BEGIN")
+        
+        # Older databases stored dose_date as ISO text; rebuild those in place
+        columns = {row["name"]: row["type"]
+                   for row in cursor.execute("PRAGMA table_info(dose_history)")}
+        legacy = columns.get("dose_date", "").upper() == "TEXT"
+        if legacy:
+            logger.info("Migrating dose_history to integer timestamps")
+            cursor.execute("ALTER TABLE dose_history RENAME TO dose_history_legacy")
+        
+        # dose_date is unix epoch seconds
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS dose_history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 tower TEXT NOT NULL,
                 solution TEXT NOT NULL,
                 volume_ml REAL NOT NULL,
-                dose_date TEXT NOT NULL,
+                dose_date INTEGER NOT NULL,
                 reason TEXT,
-                auto_dosed BOOLEAN DEFAULT 0,
+                auto_dosed INTEGER DEFAULT 0,
                 ph_before REAL,
                 ec_before REAL,
                 ph_after REAL,
                 ec_after REAL,
-                success BOOLEAN DEFAULT 1,
+                success INTEGER DEFAULT 1,
                 notes TEXT
-            )
+            ) STRICT
+        ''')
+        
+        if legacy:
+            # Legacy timestamps are naive local time
+            cursor.execute('''
+                INSERT INTO dose_history
+                (id, tower, solution, volume_ml, dose_date, reason, auto_dosed,
+                 ph_before, ec_before, ph_after, ec_after, success, notes)
+                SELECT id, tower, solution, volume_ml,
+                       CAST(strftime('%s', dose_date, 'utc') AS INTEGER), reason, auto_dosed,
+                       ph_before, ec_before, ph_after, ec_after, success, notes
+                FROM dose_history_legacy
+            ''')
+            cursor.execute("DROP TABLE dose_history_legacy")
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_dose_tower_sol_date
+            ON dose_history(tower, solution, dose_date)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_dose_tower_date
+            ON dose_history(tower, dose_date)
         ''')
         
-        conn.commit()
-        conn.close()
+        # idx_dose_tower_date also serves ORDER BY dose_date DESC (reverse scan,
+        # no temp B-tree), so get_dose_history needs no separate DESC index
+        
+        cursor.execute("COMMIT")
+        
+        # Refresh planner statistics so the indexes above are chosen
+        cursor.execute("ANALYZE")
+        
         logger.info(f"Dosing database initialized at {self.db_path}")
     
     def calculate_dose_volume(self, tower: str, solution: str, target_adjustment: float) -> float:
@@ -171,20 +304,9 @@ class DosingController:
     
     def check_daily_dose_limit(self, tower: str, solution: str, proposed_ml: float) -> bool:
         """Check if dose would exceed daily limit"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        today = datetime.now().date().isoformat()
-        
-        cursor.execute('''
-            SELECT SUM(volume_ml) FROM dose_history
-            WHERE tower = ? AND solution = ? AND DATE(dose_date) = ?
-        ''', (tower, solution, today))
-        
-        result = cursor.fetchone()[0]
-        conn.close()
-        
-        total_today = result if result else 0
+        # Count in-flight doses that have not been recorded yet
+        total_today = self._get_daily_total(tower, solution)
+        total_today += self._pending_doses.get((tower, solution), 0)
         
         if total_today + proposed_ml > self.max_dose_ml_per_day:
             logger.warning(
@@ -195,6 +317,28 @@ class DosingController:
         
         return True
     
+    def _get_daily_total(self, tower: str, solution: str) -> float:
+        """Total mL dosed today, cached and seeded from the database once per day"""
+        today = date.today()
+        
+        cached = self._daily_totals.get((tower, solution))
+        if cached and cached[0] == today:
+            return cached[1]
+        
+        # Integer bounds on dose_date keep this a range scan on the index
+        day_start = int(datetime.combine(today, datetime.min.time()).timestamp())
+        day_end = int(datetime.combine(today + timedelta(days=1), datetime.min.time()).timestamp())
+        
+        with self._lock:
+            result = self.conn.execute('''
+                SELECT SUM(volume_ml) FROM dose_history
+                WHERE tower = ? AND solution = ? AND dose_date >= ? AND dose_date < ?
+            ''', (tower, solution, day_start, day_end)).fetchone()[0]
+        
+        total = result if result else 0
+        self._daily_totals[(tower, solution)] = (today, total)
+        return total
+    
     def dose(self, tower: str, solution: str, volume_ml: float, reason: str = "", 
             auto: bool = False) -> bool:
         """
@@ -208,41 +352,91 @@ class DosingController:
             auto: Whether this is an automatic dose
         
         Returns:
-            True if successful
+            True if the dose was started. Pump run, mixing and logging
+            continue on a worker thread so the MQTT loop is not blocked.
         """
         # Safety checks
         if volume_ml <= 0:
             logger.error("Invalid dose volume")
             return False
         
-        if not self.check_daily_dose_limit(tower, solution, volume_ml):
+        if (tower, solution) not in self._pump_pin:
+            logger.error(f"No pump configured for {tower} {solution}")
             return False
         
+        with self._pending_lock:
+            if (tower, solution) in self._pending_doses:
+                logger.warning(f"{tower.upper()} {solution}: Dose already in progress, skipping")
+                return False
+            
+            if not self.check_daily_dose_limit(tower, solution, volume_ml):
+                return False
+            
+            self._pending_doses[(tower, solution)] = volume_ml
+        
+        try:
+            return self._start_dose(tower, solution, volume_ml, reason, auto)
+        except Exception:
+            with self._pending_lock:
+                self._pending_doses.pop((tower, solution), None)
+            raise
+    
+    def _start_dose(self, tower: str, solution: str, volume_ml: float, reason: str,
+                    auto: bool) -> bool:
+        """Send the pump command and hand the rest of the dose to a worker"""
+        # One timestamp for the command, the history row and the event
+        now = datetime.now()
+        now_iso = now.isoformat()
+        
         # Get current readings
-        ph_before = self.tower_status[tower]["ph"]
-        ec_before = self.tower_status[tower]["ec"]
+        ph_before = self._reading(self._ph, tower)
+        ec_before = self._reading(self._ec, tower)
         
         # Calculate pump run time
-        run_time_seconds = volume_ml / self.pump_ml_per_second
+        run_time_seconds = volume_ml * self._ml_to_sec
         
         # Send command to ESP32 via MQTT
-        pump_id = self.pump_pins[tower].get(solution)
+        pump_id = self._pump_pin[(tower, solution)]
         dose_command = {
             "pump_id": pump_id,
             "run_time_seconds": run_time_seconds,
             "volume_ml": volume_ml,
             "solution": solution,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now_iso
         }
         
-        topic = f"/{tower}/pump/command"
-        self.client.publish(topic, json.dumps(dose_command))
+        self.client.publish(self._cmd_topic[tower], orjson.dumps(dose_command))
         
         logger.info(
             f"Dosing {tower.upper()} tower: {volume_ml:.1f} mL of {solution} "
             f"(pump {pump_id} for {run_time_seconds:.1f}s)"
         )
         
+        self._pool.submit(self._finish_dose, tower, solution, volume_ml, reason, auto,
+                          ph_before, ec_before, run_time_seconds, now)
+        
+        return True
+    
+    def _finish_dose(self, tower: str, solution: str, volume_ml: float, reason: str,
+                     auto: bool, ph_before: Optional[float], ec_before: Optional[float],
+                     run_time_seconds: float, dose_time: datetime):
+        """Wait for pump and mixing, then record and announce the dose (worker thread)"""
+        try:
+            self._record_dose(tower, solution, volume_ml, reason, auto,
+                              ph_before, ec_before, run_time_seconds, dose_time)
+        except Exception as e:
+            logger.error(f"Error completing {tower} {solution} dose: {e}")
+        finally:
+            with self._pending_lock:
+                self._pending_doses.pop((tower, solution), None)
+    
+    def _record_dose(self, tower: str, solution: str, volume_ml: float, reason: str,
+                     auto: bool, ph_before: Optional[float], ec_before: Optional[float],
+                     run_time_seconds: float, dose_time: datetime):
+        """Record a dose once the pump has run and the reservoir has mixed"""
+        dose_time_iso = dose_time.isoformat()
+        dose_epoch = int(dose_time.timestamp())
+        
         # Wait for pump to finish
         time.sleep(run_time_seconds + 2)
         
@@ -250,20 +444,27 @@ class DosingController:
         logger.info("Waiting for solution to mix...")
         time.sleep(30)
         
-        # Record dose
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO dose_history
-            (tower, solution, volume_ml, dose_date, reason, auto_dosed, 
-             ph_before, ec_before, ph_after, ec_after, success)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (tower, solution, volume_ml, datetime.now().isoformat(), reason,
-              auto, ph_before, ec_before, None, None, True))
-        
-        conn.commit()
-        conn.close()
+        # Record dose with post-mix readings in a single transaction
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute('''
+                    INSERT INTO dose_history
+                    (tower, solution, volume_ml, dose_date, reason, auto_dosed, 
+                     ph_before, ec_before, ph_after, ec_after, success)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (tower, solution, volume_ml, dose_epoch, reason,
+                      auto, ph_before, ec_before,
+                      self._reading(self._ph, tower), self._reading(self._ec, tower), True))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        
+        # Keep today's running total current; a stale day re-seeds from the DB
+        cached = self._daily_totals.get((tower, solution))
+        if cached and cached[0] == dose_time.date():
+            self._daily_totals[(tower, solution)] = (cached[0], cached[1] + volume_ml)
         
         # Publish dosing event
         event_data = {
@@ -272,19 +473,17 @@ class DosingController:
             "volume_ml": volume_ml,
             "reason": reason,
             "auto": auto,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": dose_time_iso
         }
         
-        self.client.publish("/events/dose", json.dumps(event_data))
-        
-        return True
+        self.client.publish("/events/dose", orjson.dumps(event_data))
     
     def auto_adjust_ph(self, tower: str):
         """Automatically adjust pH if out of range"""
         if not self.auto_dosing_enabled:
             return
         
-        current_ph = self.tower_status[tower]["ph"]
+        current_ph = self._reading(self._ph, tower)
         if current_ph is None:
             return
         
@@ -341,37 +540,36 @@ class DosingController:
             auto=True
         )
     
-    def get_dose_history(self, tower: str, days: int = 7) -> List[Dict]:
-        """Get dosing history for tower"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
-        
-        cursor.execute('''
-            SELECT solution, volume_ml, dose_date, reason, auto_dosed
-            FROM dose_history
-            WHERE tower = ? AND dose_date >= ?
-            ORDER BY dose_date DESC
-        ''', (tower, cutoff))
-        
-        history = []
-        for row in cursor.fetchall():
-            history.append({
-                "solution": row[0],
-                "volume_ml": row[1],
-                "date": row[2],
-                "reason": row[3],
-                "auto": bool(row[4])
-            })
-        
-        conn.close()
-        return history
+    def get_dose_history(self, tower: str, days: int = 7,
+                         limit: int = DOSE_HISTORY_PAGE_SIZE, offset: int = 0) -> List[Dict]:
+        """Get dosing history for tower, newest first, one page at a time"""
+        cutoff = int((datetime.now() - timedelta(days=days)).timestamp())
+        
+        with self._lock:
+            rows = self.conn.execute('''
+                SELECT solution, volume_ml, dose_date, reason, auto_dosed
+                FROM dose_history
+                WHERE tower = ? AND dose_date >= ?
+                ORDER BY dose_date DESC
+                LIMIT ? OFFSET ?
+            ''', (tower, cutoff, limit, offset)).fetchall()
+        
+        return [
+            {
+                "solution": row["solution"],
+                "volume_ml": row["volume_ml"],
+                "date": datetime.fromtimestamp(row["dose_date"]).isoformat(),
+                "reason": row["reason"],
+                "auto": bool(row["auto_dosed"])
+            }
+            for row in rows
+        ]
     
     def on_connect(self, client, userdata, flags, rc):
         """MQTT connection handler"""
         if rc == 0:
             logger.info("Connected to MQTT broker")
+            client.publish(STATUS_TOPIC, "online", retain=True)
             # Subscribe to sensor readings
             client.subscribe("/+/ph")
             client.subscribe("/+/ec")
@@ -383,49 +581,76 @@ class DosingController:
         else:
             logger.error(f"MQTT connection failed: {rc}")
     
-    def on_message(self, client, userdata, msg):
-        """MQTT message handler"""
+    def _on_ph(self, tower: str, client, userdata, msg):
+        """pH reading from /<tower>/ph"""
         try:
-            topic = msg.topic
+            self._ph[self._tidx[tower]] = float(msg.payload)
+            # Check if auto-adjustment needed
+            self.auto_adjust_ph(tower)
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+    
+    def _on_ec(self, tower: str, client, userdata, msg):
+        """EC reading from /<tower>/ec"""
+        try:
+            self._ec[self._tidx[tower]] = float(msg.payload)
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+    
+    def _on_water_temp(self, tower: str, client, userdata, msg):
+        """Water temperature reading from /<tower>/water_temp"""
+        try:
+            self._temp[self._tidx[tower]] = float(msg.payload)
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+    
+    def _is_replayed_command(self, msg, payload: Dict) -> bool:
+        """True if a command is a retained replay or a dose_id already handled"""
+        if msg.retain:
+            # Retained copies are re-delivered on every (re)connect
+            logger.warning(f"Ignoring retained command on {msg.topic}")
+            return True
+        
+        dose_id = payload.get("dose_id")
+        if dose_id is None:
+            return False
+        
+        if dose_id in self._recent_doses:
+            logger.warning(f"Ignoring duplicate dose_id {dose_id} on {msg.topic}")
+            return True
+        
+        self._recent_doses[dose_id] = time.time()
+        if len(self._recent_doses) > RECENT_DOSE_IDS_MAX:
+            self._recent_doses.popitem(last=False)
+        return False
+    
+    def _on_dosing_command(self, client, userdata, msg):
+        """Manual dosing command from /dosing/<tower>/command"""
+        try:
+            tower = msg.topic.split('/', 3)[2]
             
-            # Update sensor readings
-            if topic.endswith("/ph") or topic.endswith("/ec") or topic.endswith("/water_temp"):
-                parts = topic.strip('/').split('/')
-                tower = parts[0]
-                sensor = parts[1]
-                value = float(msg.payload.decode())
-                
-                if sensor == "ph":
-                    self.tower_status[tower]["ph"] = value
-                    # Check if auto-adjustment needed
-                    self.auto_adjust_ph(tower)
-                
-                elif sensor == "ec":
-                    self.tower_status[tower]["ec"] = value
-                
-                elif sensor == "water_temp":
-                    self.tower_status[tower]["temp"] = value
+            payload = orjson.loads(msg.payload)
+            if self._is_replayed_command(msg, payload):
+                return
+            solution = payload.get("solution")
+            volume = payload.get("volume_ml")
+            reason = payload.get("reason", "Manual dose")
             
-            # Handle manual dosing commands
-            elif "/dosing/" in topic and "/command" in topic:
-                parts = topic.split('/')
-                tower = parts[2]
-                
-                payload = json.loads(msg.payload.decode())
-                solution = payload.get("solution")
-                volume = payload.get("volume_ml")
-                reason = payload.get("reason", "Manual dose")
-                
-                self.dose(tower, solution, volume, reason, auto=False)
+            self.dose(tower, solution, volume, reason, auto=False)
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+    
+    def _on_deficiency(self, client, userdata, msg):
+        """AI deficiency alert from /alerts/deficiency"""
+        try:
+            payload = orjson.loads(msg.payload)
+            if self._is_replayed_command(msg, payload):
+                return
             
-            # Handle AI deficiency alerts
-            elif topic == "/alerts/deficiency":
-                payload = json.loads(msg.payload.decode())
-                tower = payload.get("tower")
-                deficiency = payload.get("deficiency")
-                
-                self.auto_adjust_nutrients(tower, deficiency)
-        
+            tower = payload.get("tower")
+            deficiency = payload.get("deficiency")
+            
+            self.auto_adjust_nutrients(tower, deficiency)
         except Exception as e:
             logger.error(f"Error processing message: {e}")
     
@@ -438,12 +663,18 @@ class DosingController:
             self.client.loop_forever()
         except KeyboardInterrupt:
             logger.info("Shutting down Dosing Controller...")
+            self.client.publish(STATUS_TOPIC, "offline", retain=True)
             self.client.disconnect()
         except Exception as e:
             logger.error(f"Fatal error: {e}")
             raise
 
 def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    load_environment()
     controller = DosingController()
     controller.run()
 
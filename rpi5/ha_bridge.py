@@ -13,24 +13,76 @@ Features:
 """
 
 import os
-import json
 import logging
+from collections import deque
 from datetime import datetime
-from typing import Dict
-import paho.mqtt.client as mqtt
-from dotenv import load_dotenv
-import time
+from typing import Dict, List, Tuple
+import orjson
+
+from mqtt_singleton import add_connect_handler, get_client, load_environment
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+TOWERS = ("cool", "warm")
+
+# Static discovery config per sensor type
+SENSOR_DEFS = (
+    ("ph", {
+        "name": "pH",
+        "unit_of_measurement": "pH",
+        "device_class": "ph",
+        "state_class": "measurement",
+        "icon": "mdi:ph"
+    }),
+    ("ec", {
+        "name": "EC",
+        "unit_of_measurement": "mS/cm",
+        "state_class": "measurement",
+        "icon": "mdi:flash"
+    }),
+    ("water_temp", {
+        "name": "Water Temperature",
+        "unit_of_measurement": "°F",
+        "device_class": "temperature",
+        "state_class": "measurement",
+        "icon": "mdi:thermometer-water"
+    }),
+    ("air_temp", {
+        "name": "Air Temperature",
+        "unit_of_measurement": "°F",
+        "device_class": "temperature",
+        "state_class": "measurement",
+        "icon": "mdi:thermometer"
+    }),
+    ("air_humidity", {
+        "name": "Air Humidity",
+        "unit_of_measurement": "%",
+        "device_class": "humidity",
+        "state_class": "measurement",
+        "icon": "mdi:water-percent"
+    }),
+    ("vpd", {
+        "name": "VPD",
+        "unit_of_measurement": "kPa",
+        "state_class": "measurement",
+        "icon": "mdi:chart-line"
+    })
+)
+
+LIGHT_DEF = {
+    "brightness_scale": 100,
+    "schema": "json"
+}
+
+BINARY_DEF = {
+    "payload_on": "healthy",
+    "payload_off": "alert",
+    "device_class": "problem",
+    "icon": "mdi:leaf"
+}
 
 class HomeAssistantBridge:
-    def __init__(self):
+    def __init__(self, client=None):
         # MQTT Configuration
         self.broker = os.getenv("MQTT_BROKER", "10.0.0.62")
         self.port = int(os.getenv("MQTT_PORT", 1883))
@@ -42,14 +94,22 @@ class HomeAssistantBridge:
         self.device_name = "Pydro"
         self.device_id = "pydro_ai_hydro_system"
         
-        # MQTT client
-        self.client = mqtt.Client()
-        self.client.username_pw_set(self.username, self.password)
-        self.client.on_connect = self.on_connect
+        # Discovery payloads never change, so serialize them once
+        self._device_cfg = self.create_device_config()
+        self._discovery_msgs = self.build_discovery_messages()
+        
+        # MQTT client, shared with any other service in this process
+        self.client = client or get_client()
+        add_connect_handler(self.client, self.on_connect)
+        self.client.message_callback_add(f"{self.discovery_prefix}/status", self.on_ha_status)
+        self._discovery_published = False
         
         # Track user presence for arrival notifications
         self.user_home = False
-        self.pending_announcements = []
+        # Oldest announcements drop off once the queue is full
+        self.pending_announcements = deque(
+            maxlen=int(os.getenv("HA_ANNOUNCEMENT_QUEUE_MAX", 64))
+        )
         
         logger.info("Home Assistant Bridge initialized")
     
@@ -63,129 +123,65 @@ class HomeAssistantBridge:
             "sw_version": "1.0.0"
         }
     
-    def publish_sensor_discovery(self, tower: str, sensor_type: str, config: Dict):
-        """Publish MQTT discovery message for a sensor"""
-        # Create unique ID
-        object_id = f"{tower}_{sensor_type}"
-        unique_id = f"{self.device_id}_{object_id}"
-        
-        # Discovery topic
-        discovery_topic = f"{self.discovery_prefix}/sensor/{self.device_id}/{object_id}/config"
-        
-        # Base configuration
-        discovery_config = {
-            "name": f"{tower.capitalize()} Tower {config.get('name', sensor_type)}",
-            "unique_id": unique_id,
-            "state_topic": f"/{tower}/{sensor_type}",
-            "device": self.create_device_config(),
-            "object_id": object_id,
-        }
-        
-        # Merge with provided config
-        discovery_config.update(config)
-        
-        # Publish
-        self.client.publish(discovery_topic, json.dumps(discovery_config), retain=True)
-        logger.info(f"Published discovery for {tower} {sensor_type}")
-    
-    def setup_all_sensors(self):
-        """Setup all sensor discoveries"""
-        towers = ["cool", "warm"]
-        
-        # pH sensors
-        for tower in towers:
-            self.publish_sensor_discovery(tower, "ph", {
-                "name": "pH",
-                "unit_of_measurement": "pH",
-                "device_class": "ph",
-                "state_class": "measurement",
-                "icon": "mdi:ph"
-            })
-        
-        # EC sensors
-        for tower in towers:
-            self.publish_sensor_discovery(tower, "ec", {
-                "name": "EC",
-                "unit_of_measurement": "mS/cm",
-                "state_class": "measurement",
-                "icon": "mdi:flash"
-            })
-        
-        # Water temperature
-        for tower in towers:
-            self.publish_sensor_discovery(tower, "water_temp", {
-                "name": "Water Temperature",
-                "unit_of_measurement": "°F",
-                "device_class": "temperature",
-                "state_class": "measurement",
-                "icon": "mdi:thermometer-water"
-            })
-        
-        # Air temperature
-        for tower in towers:
-            self.publish_sensor_discovery(tower, "air_temp", {
-                "name": "Air Temperature",
-                "unit_of_measurement": "°F",
-                "device_class": "temperature",
-                "state_class": "measurement",
-                "icon": "mdi:thermometer"
-            })
-        
-        # Air humidity
-        for tower in towers:
-            self.publish_sensor_discovery(tower, "air_humidity", {
-                "name": "Air Humidity",
-                "unit_of_measurement": "%",
-                "device_class": "humidity",
-                "state_class": "measurement",
-                "icon": "mdi:water-percent"
-            })
-        
-        # VPD
-        for tower in towers:
-            self.publish_sensor_discovery(tower, "vpd", {
-                "name": "VPD",
-                "unit_of_measurement": "kPa",
-                "state_class": "measurement",
-                "icon": "mdi:chart-line"
-            })
-        
-        # LED status
-        for tower in towers:
-            discovery_topic = f"{self.discovery_prefix}/light/{self.device_id}/{tower}_led/config"
-            config = {
-                "name": f"{tower.capitalize()} Tower LED",
-                "unique_id": f"{self.device_id}_{tower}_led",
-                "state_topic": f"/{tower}/led_status",
-                "command_topic": f"/{tower}/led_command",
-                "device": self.create_device_config(),
-                "brightness_scale": 100,
-                "brightness_state_topic": f"/{tower}/led_brightness",
-                "brightness_command_topic": f"/{tower}/led_brightness/set",
-                "schema": "json"
-            }
-            self.client.publish(discovery_topic, json.dumps(config), retain=True)
-        
-        logger.info("All sensor discoveries published")
+    def discovery_message(self, discovery_topic: str, config: Dict) -> Tuple[str, bytes]:
+        """Serialize a discovery config once for repeated publishing"""
+        return discovery_topic, orjson.dumps(config)
     
-    def setup_binary_sensors(self):
-        """Setup binary sensors for alerts"""
-        towers = ["cool", "warm"]
-        
-        for tower in towers:
+    def build_discovery_messages(self) -> List[Tuple[str, bytes]]:
+        """Build every discovery message for both towers"""
+        prefix = self.discovery_prefix
+        device_id = self.device_id
+        messages = []
+        
+        for tower in TOWERS:
+            # Sensors
+            for sensor_type, static_config in SENSOR_DEFS:
+                object_id = f"{tower}_{sensor_type}"
+                messages.append(self.discovery_message(
+                    f"{prefix}/sensor/{device_id}/{object_id}/config", {
+                        "unique_id": f"{device_id}_{object_id}",
+                        "state_topic": f"/{tower}/{sensor_type}",
+                        "device": self._device_cfg,
+                        "object_id": object_id,
+                        **static_config
+                    }))
+            
+            # LED status
+            messages.append(self.discovery_message(
+                f"{prefix}/light/{device_id}/{tower}_led/config", {
+                    "name": f"{tower.capitalize()} Tower LED",
+                    "unique_id": f"{device_id}_{tower}_led",
+                    "state_topic": f"/{tower}/led_status",
+                    "command_topic": f"/{tower}/led_command",
+                    "device": self._device_cfg,
+                    "brightness_state_topic": f"/{tower}/led_brightness",
+                    "brightness_command_topic": f"/{tower}/led_brightness/set",
+                    **LIGHT_DEF
+                }))
+            
             # System health binary sensor
-            discovery_topic = f"{self.discovery_prefix}/binary_sensor/{self.device_id}/{tower}_health/config"
-            config = {
-                "name": f"{tower.capitalize()} Tower Health",
-                "unique_id": f"{self.device_id}_{tower}_health",
-                "state_topic": f"/{tower}/health",
-                "device": self.create_device_config(),
-                "payload_on": "healthy",
-                "payload_off": "alert",
-                "device_class": "problem",
-                "icon": "mdi:leaf"
-            }
-            self.client.publish(discovery_topic, json.dumps(config), retain=True)
+            messages.append(self.discovery_message(
+                f"{prefix}/binary_sensor/{device_id}/{tower}_health/config", {
+                    "name": f"{tower.capitalize()} Tower Health",
+                    "unique_id": f"{device_id}_{tower}_health",
+                    "state_topic": f"/{tower}/health",
+                    "device": self._device_cfg,
+                    **BINARY_DEF
+                }))
+        
+        return messages
+    
+    def publish_discovery(self):
+        """Publish all cached discovery messages (retained) back to back"""
+        for topic, payload in self._discovery_msgs:
+            self.client.publish(topic, payload, qos=0, retain=True)
+        self._discovery_published = True
+        logger.info(f"Published {len(self._discovery_msgs)} discovery messages")
+    
+    def on_ha_status(self, client, userdata, msg):
+        """Republish discovery when Home Assistant comes (back) online"""
+        if msg.payload == b"online":
+            self.publish_discovery()
     
     def setup_person_tracking(self):
         """Setup person tracking for arrival notifications"""
@@ -197,10 +193,11 @@ class HomeAssistantBridge:
         if rc == 0:
             logger.info("Connected to MQTT broker")
             
-            # Publish all discovery messages
-            time.sleep(1)  # Give broker time to settle
-            self.setup_all_sensors()
-            self.setup_binary_sensors()
+            # Discovery is retained, so the broker keeps it across our
+            # reconnects; HA's birth message triggers any later republish
+            if not self._discovery_published:
+                self.publish_discovery()
+            client.subscribe(f"{self.discovery_prefix}/status")
             
             # Setup person tracking if enabled
             arrival_delay = int(os.getenv("HA_ARRIVAL_DELAY_MINUTES", 5))
@@ -227,6 +224,11 @@ class HomeAssistantBridge:
             raise
 
 def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    load_environment()
     bridge = HomeAssistantBridge()
     bridge.run()
 
@@ -9,18 +9,25 @@ Dual Tower Hydroponic System - Brian Altmaier
 
 import os
 import sys
+import multiprocessing
 import time
 import logging
+from collections import OrderedDict
 from pathlib import Path
-from datetime import datetime, timedelta
-from threading import Thread, Event
-import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Thread, Event, Lock, Timer
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+import orjson
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+import requests
 from dotenv import load_dotenv
 
 # Import local modules
 from sensor_monitor import SensorMonitor, THRESHOLDS
-from image_analyzer import ImageAnalyzer
+from image_analyzer import init_analysis_worker, analysis_worker_model_loaded, run_analysis_batch
 from sms_alerts import SMSAlertSystem
 from nutrient_advisor import NutrientAdvisor
 
@@ -30,6 +37,9 @@ load_dotenv()
 LOG_PATH = Path(os.getenv('LOG_PATH', '/home/pi/hydro_logs'))
 LOG_PATH.mkdir(parents=True, exist_ok=True)
 
+# LED levels and last analysis times, kept across restarts
+STATE_PATH = LOG_PATH / 'state.json'
+
 logging.basicConfig(
     level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -41,6 +51,31 @@ logging.basicConfig(
 
 logger = logging.getLogger('hydro_ai_main')
 
+# Camera topics carry either JSON metadata or the JPEG itself
+JPEG_SOI = b'\xff\xd8'
+
+# Seconds to hold a tower's ready image pair so the other tower can join
+# the same ML inference batch
+ANALYSIS_BATCH_WINDOW = 0.2
+
+# MQTT v5 session settings: the broker keeps our subscriptions (and queues
+# QoS 1+ messages) across reconnects shorter than this
+MQTT_SESSION_EXPIRY_SECONDS = 3600
+MQTT_MAX_INFLIGHT = 64
+
+# How many recent frame hashes to remember; repeats only come from recent captures
+DOWNLOADED_IMAGES_MAX = 64
+
+
+class RemoteImage(NamedTuple):
+    """A frame still on its camera's HTTP server, fetched by the analysis thread"""
+    url: str
+    filename: str
+    sha256: Optional[str] = None
+
+# A received frame: file on disk, JPEG bytes, or not yet downloaded
+PendingImage = Union[Path, bytes, RemoteImage]
+
 
 class HydroponicAISystem:
     def __init__(self):
@@ -52,12 +87,19 @@ class HydroponicAISystem:
         self.mqtt_username = os.getenv('MQTT_USERNAME', 'hydro_user')
         self.mqtt_password = os.getenv('MQTT_PASSWORD', '')
         
+        # Optional shared-subscription group for running several analyzers
+        self.mqtt_share_group = os.getenv('AI_MQTT_SHARE_GROUP', '')
+        
         self.image_storage_path = Path(os.getenv('IMAGE_STORAGE_PATH', '/home/pi/hydro_images'))
         self.image_storage_path.mkdir(parents=True, exist_ok=True)
         
+        # Recently downloaded camera images by content hash, to skip identical
+        # frames (oldest first, capped at DOWNLOADED_IMAGES_MAX)
+        self.downloaded_images = OrderedDict()
+        
         # Components
         self.sensor_monitor = None
-        self.image_analyzer = None
+        self.image_analyzer_pool = None
         self.sms_alerts = None
         self.nutrient_advisor = None
         self.mqtt_client = None
@@ -67,9 +109,20 @@ class HydroponicAISystem:
             'cool': {'visible': None, 'noir': None},
             'warm': {'visible': None, 'noir': None}
         }
+        self._pending_lock = Lock()
+        
+        # Image analysis runs off the MQTT thread: this thread hands batches to
+        # the analyzer process and acts on the results, one batch at a time
+        self._analysis_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analysis')
+        
+        # Image pairs waiting for the batch window: tower -> (visible, noir)
+        self._ready_towers = {}
+        self._batch_timer = None
+        
+        # time.monotonic() of each tower's last analysis
         self.last_image_analysis = {
-            'cool': datetime.now() - timedelta(hours=5),
-            'warm': datetime.now() - timedelta(hours=5)
+            'cool': time.monotonic() - 5 * 3600,
+            'warm': time.monotonic() - 5 * 3600
         }
         
         # LED control state
@@ -77,10 +130,11 @@ class HydroponicAISystem:
             'cool': 75,
             'warm': 75
         }
+        self._state_lock = Lock()
+        self._load_state()
         
-        # Control
-        self.running = Event()
-        self.running.set()
+        # Control (not set = running)
+        self._shutdown = Event()
         
         # Initialize components
         self._initialize_components()
@@ -95,8 +149,9 @@ class HydroponicAISystem:
             logger.error("Failed to initialize sensor monitor")
         
         # Image Analyzer
-        self.image_analyzer = ImageAnalyzer()
-        logger.info(f"Image analyzer initialized (ML model: {self.image_analyzer.model_loaded})")
+        self.image_analyzer_pool = self._start_image_analyzer()
+        model_loaded = self.image_analyzer_pool.submit(analysis_worker_model_loaded).result()
+        logger.info(f"Image analyzer initialized (ML model: {model_loaded})")
         
         # SMS Alerts
         self.sms_alerts = SMSAlertSystem()
@@ -115,20 +170,30 @@ class HydroponicAISystem:
     
     def _setup_mqtt_camera_listener(self):
         """Setup MQTT listener for camera image notifications"""
-        self.mqtt_client = mqtt.Client(client_id="rpi5_ai_main")
+        self.mqtt_client = mqtt.Client(client_id="rpi5_ai_main", protocol=mqtt.MQTTv5)
         self.mqtt_client.username_pw_set(self.mqtt_username, self.mqtt_password)
+        self.mqtt_client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
         
-        def on_connect(client, userdata, flags, rc):
+        def on_connect(client, userdata, flags, rc, properties=None):
             if rc == 0:
+                # Resumed session - the broker still has our subscriptions
+                if flags.get('session present'):
+                    logger.info("Resumed MQTT session, camera subscriptions kept")
+                    return
+                
                 # Subscribe to camera image topics
                 topics = [
-                    ('/cool_tower/camera/visible', 0),
-                    ('/cool_tower/camera/noir', 0),
-                    ('/warm_tower/camera/visible', 0),
-                    ('/warm_tower/camera/noir', 0),
+                    '/cool_tower/camera/visible',
+                    '/cool_tower/camera/noir',
+                    '/warm_tower/camera/visible',
+                    '/warm_tower/camera/noir',
                 ]
-                client.subscribe(topics)
+                if self.mqtt_share_group:
+                    topics = [f"$share/{self.mqtt_share_group}/{topic}" for topic in topics]
+                client.subscribe([(topic, 0) for topic in topics])
                 logger.info("Subscribed to camera image topics")
+            else:
+                logger.error(f"MQTT camera listener connection failed: {rc}")
         
         def on_message(client, userdata, msg):
             self._handle_camera_image(msg.topic, msg.payload)
@@ -137,63 +202,167 @@ class HydroponicAISystem:
         self.mqtt_client.on_message = on_message
         
         try:
-            self.mqtt_client.connect(self.mqtt_broker, self.mqtt_port, 60)
+            properties = Properties(PacketTypes.CONNECT)
+            properties.SessionExpiryInterval = MQTT_SESSION_EXPIRY_SECONDS
+            self.mqtt_client.connect(self.mqtt_broker, self.mqtt_port, 60,
+                                     clean_start=mqtt.MQTT_CLEAN_START_FIRST_ONLY,
+                                     properties=properties)
             self.mqtt_client.loop_start()
         except Exception as e:
             logger.error(f"Failed to connect MQTT camera listener: {e}")
     
     def _handle_camera_image(self, topic, payload):
-        """Handle incoming camera image notification"""
+        """Handle incoming camera image (inline JPEG) or image notification (JSON)"""
         try:
-            metadata = json.loads(payload.decode('utf-8'))
-            tower = metadata['tower']
-            camera_type = metadata['camera_type']
-            filepath = Path(metadata['filepath'])
-            
-            logger.info(f"Received {camera_type} image from {tower} tower: {filepath.name}")
+            if payload[:2] == JPEG_SOI:
+                # Frame sent inline on /<tower>_tower/camera/<camera_type>
+                tower_topic, _, camera_type = topic.strip('/').split('/')
+                tower = tower_topic.rsplit('_', 1)[0]
+                image = payload
+                
+                logger.info(f"Received {camera_type} image from {tower} tower: {len(payload)} bytes inline")
+            else:
+                metadata = orjson.loads(payload)
+                tower = metadata['tower']
+                camera_type = metadata['camera_type']
+                image = Path(metadata['filepath'])
+                
+                logger.info(f"Received {camera_type} image from {tower} tower: {image.name}")
+                
+                # Pulled from the camera's HTTP server later, off the MQTT thread
+                if metadata.get('url'):
+                    image = RemoteImage(metadata['url'], image.name, metadata.get('sha256'))
             
-            # Store image path
-            self.pending_images[tower][camera_type] = filepath
+            # Store image (path, JPEG bytes or remote); take the pair once both visible and NOIR are in
+            with self._pending_lock:
+                self.pending_images[tower][camera_type] = image
+                pair = self.pending_images[tower]
+                if not all(pair.values()):
+                    return
+                self.pending_images[tower] = {'visible': None, 'noir': None}
+                
+                # Both images ready - batch with the other tower if it's close behind
+                self._ready_towers[tower] = (pair['visible'], pair['noir'])
+                if len(self._ready_towers) < len(self.pending_images):
+                    if self._batch_timer is None:
+                        self._batch_timer = Timer(ANALYSIS_BATCH_WINDOW, self._submit_ready_towers)
+                        self._batch_timer.daemon = True
+                        self._batch_timer.start()
+                    return
             
-            # Check if we have both visible and NOIR for this tower
-            if all(self.pending_images[tower].values()):
-                # Both images ready - analyze
-                self._analyze_tower_images(tower)
+            # Every tower is in - no need to wait out the window
+            self._submit_ready_towers()
                 
         except Exception as e:
             logger.error(f"Error handling camera image: {e}")
     
-    def _analyze_tower_images(self, tower: str):
-        """Analyze visible and NOIR images for a tower"""
-        logger.info(f"Analyzing images for {tower} tower...")
-        
-        visible_path = self.pending_images[tower]['visible']
-        noir_path = self.pending_images[tower]['noir']
-        
-        # Run image analysis
-        results = self.image_analyzer.analyze_images(visible_path, noir_path, tower)
+    def _download_image(self, url: str, filename: str, sha256: str = None) -> Union[Path, bytes]:
+        """
+        Fetch an image from a camera (analysis worker thread)
+        
+        Returns the JPEG bytes (also archived to image storage) so analysis
+        decodes from memory, or the archived path if the same frame was
+        already downloaded.
+        """
+        # Identical frame already on disk - reuse it
+        known_path = self.downloaded_images.get(sha256)
+        if known_path and known_path.exists():
+            self.downloaded_images.move_to_end(sha256)
+            logger.debug(f"Skipping download of {filename}, same content as {known_path.name}")
+            return known_path
+        
+        local_path = self.image_storage_path / filename
+        
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        data = response.content
+        
+        # Archive copy only; analysis works from the bytes in memory
+        local_path.write_bytes(data)
+        if sha256:
+            self.downloaded_images[sha256] = local_path
+            if len(self.downloaded_images) > DOWNLOADED_IMAGES_MAX:
+                self.downloaded_images.popitem(last=False)
+        
+        logger.debug(f"Downloaded {filename} from {url}")
+        return data
+    
+    def _start_image_analyzer(self) -> ProcessPoolExecutor:
+        """Start the image analyzer process (keeps the GIL-bound work off this one)"""
+        # spawn, not fork: the MQTT network threads are already running
+        return ProcessPoolExecutor(max_workers=1,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_analysis_worker)
+    
+    def _submit_ready_towers(self):
+        """Hand every ready image pair to the analysis worker as one batch"""
+        with self._pending_lock:
+            if self._batch_timer is not None:
+                self._batch_timer.cancel()
+                self._batch_timer = None
+            batch = [(tower, visible, noir) for tower, (visible, noir) in self._ready_towers.items()]
+            self._ready_towers = {}
+        
+        if batch:
+            self._analysis_pool.submit(self._analyze_tower_images, batch)
+    
+    def _fetch_remote_images(self, batch: List[Tuple[str, PendingImage, PendingImage]]):
+        """Download any RemoteImage in the batch, dropping towers whose fetch fails"""
+        fetched = []
+        for tower, visible, noir in batch:
+            try:
+                if isinstance(visible, RemoteImage):
+                    visible = self._download_image(*visible)
+                if isinstance(noir, RemoteImage):
+                    noir = self._download_image(*noir)
+            except Exception as e:
+                logger.error(f"Error downloading {tower} tower images: {e}")
+                continue
+            fetched.append((tower, visible, noir))
+        return fetched
+    
+    def _analyze_tower_images(self, batch: List[Tuple[str, PendingImage, PendingImage]]):
+        """Analyze visible and NOIR images for a batch of towers (analysis worker thread)"""
+        batch = self._fetch_remote_images(batch)
+        if not batch:
+            return
         
-        self.last_image_analysis[tower] = datetime.now()
+        towers = [tower for tower, _, _ in batch]
+        try:
+            logger.info(f"Analyzing images for {', '.join(towers)} tower(s)...")
+            
+            # Run image analysis (one ML inference for the whole batch)
+            batch_results = self.image_analyzer_pool.submit(run_analysis_batch, batch).result()
+            
+            for tower, results in zip(towers, batch_results):
+                self._handle_analysis_results(tower, results)
+        except BrokenProcessPool:
+            logger.error(f"Image analyzer process died analyzing {', '.join(towers)} tower images - restarting it")
+            if not self._shutdown.is_set():
+                self.image_analyzer_pool = self._start_image_analyzer()
+        except Exception as e:
+            logger.error(f"Error analyzing {', '.join(towers)} tower images: {e}", exc_info=True)
+    
+    def _handle_analysis_results(self, tower: str, results: Dict):
+        """Log a tower's analysis results and act on them"""
+        self.last_image_analysis[tower] = time.monotonic()
         
         # Log results
         logger.info(f"{tower.capitalize()} Tower Analysis Results:")
         logger.info(f"  Health Score: {results['health_score']}/100")
         logger.info(f"  Deficiencies: {len(results['deficiencies'])}")
         for deficiency in results['deficiencies']:
-            logger.info(f"    - {deficiency['type']} (confidence: {deficiency.get('confidence', 0):.2f})")
+            logger.info(f"    - {deficiency.type} (confidence: {deficiency.confidence:.2f})")
         
         # Handle detected issues
         if results['deficiencies']:
             self._handle_image_deficiencies(tower, results)
-        
-        # Clear pending images
-        self.pending_images[tower] = {'visible': None, 'noir': None}
     
     def _handle_image_deficiencies(self, tower: str, results: Dict):
         """Handle deficiencies detected in images"""
         for deficiency in results['deficiencies']:
-            deficiency_type = deficiency['type']
-            confidence = deficiency.get('confidence', 0.5)
+            deficiency_type = deficiency.type
+            confidence = deficiency.confidence
             
             # Skip low confidence detections
             if confidence < 0.5:
@@ -225,7 +394,7 @@ class HydroponicAISystem:
                 tower,
                 deficiency_type,
                 sensor_data['sensor_data'],
-                deficiencies=[d['type'] for d in results['deficiencies']]
+                deficiencies=[d.type for d in results['deficiencies']]
             )
             
             # Send SMS alert
@@ -267,6 +436,41 @@ class HydroponicAISystem:
         # Send SMS alert
         self.sms_alerts.send_sensor_alert(tower, issue, sensor_data, env_data)
     
+    def _load_state(self):
+        """Restore LED levels and last analysis times saved by a previous run"""
+        if not STATE_PATH.exists():
+            return
+        
+        try:
+            state = orjson.loads(STATE_PATH.read_bytes())
+            self.current_led_intensity.update(state['led_intensity'])
+            
+            # Saved as wall-clock time; monotonic clocks don't survive a restart
+            age_offset = time.monotonic() - time.time()
+            for tower, analyzed_at in state['last_image_analysis'].items():
+                self.last_image_analysis[tower] = analyzed_at + age_offset
+            
+            logger.info(f"Restored state from {STATE_PATH}")
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable state file {STATE_PATH}: {e}")
+    
+    def _save_state(self):
+        """Persist LED levels and last analysis times"""
+        wall_offset = time.time() - time.monotonic()
+        state = {
+            'led_intensity': self.current_led_intensity,
+            'last_image_analysis': {tower: analyzed_at + wall_offset
+                                    for tower, analyzed_at in self.last_image_analysis.items()}
+        }
+        
+        try:
+            with self._state_lock:
+                tmp_path = STATE_PATH.with_suffix('.tmp')
+                tmp_path.write_bytes(orjson.dumps(state))
+                tmp_path.replace(STATE_PATH)
+        except Exception as e:
+            logger.error(f"Failed to save state: {e}")
+    
     def _adjust_led_intensity(self, tower: str, intensity: int, reason: str):
         """Adjust LED grow light intensity"""
         if intensity == self.current_led_intensity[tower]:
@@ -277,6 +481,7 @@ class HydroponicAISystem:
         try:
             self.mqtt_client.publish(topic, str(intensity))
             self.current_led_intensity[tower] = intensity
+            self._save_state()
             
             logger.info(f"Adjusted {tower} tower LED to {intensity}% ({reason})")
             
@@ -292,11 +497,9 @@ class HydroponicAISystem:
         logger.info("Press Ctrl+C to stop")
         
         try:
-            while self.running.is_set():
-                # Main loop - most work is event-driven via MQTT callbacks
-                
-                # Periodic health checks every 5 minutes
-                time.sleep(300)
+            # Main loop - most work is event-driven via MQTT callbacks
+            # Periodic health checks every 5 minutes; wakes at once on shutdown
+            while not self._shutdown.wait(timeout=300):
                 self._periodic_health_check()
                 
         except KeyboardInterrupt:
@@ -310,18 +513,20 @@ class HydroponicAISystem:
         """Periodic system health check"""
         logger.debug("Running periodic health check...")
         
+        now = time.monotonic()
+        
         # Check for stale sensor data (no updates in 10 minutes)
         for tower in ['cool', 'warm']:
             tower_data = self.sensor_monitor.sensor_data[tower]
             if tower_data['last_update']:
-                time_since_update = (datetime.now() - tower_data['last_update']).seconds
+                time_since_update = int(now - tower_data['last_update'])
                 if time_since_update > 600:  # 10 minutes
                     logger.warning(f"{tower.capitalize()} tower sensors stale ({time_since_update}s since last update)")
         
         # Check environment sensor
         env_data = self.sensor_monitor.sensor_data['environment']
         if env_data['last_update']:
-            time_since_update = (datetime.now() - env_data['last_update']).seconds
+            time_since_update = int(now - env_data['last_update'])
             if time_since_update > 600:
                 logger.warning(f"Environment sensor stale ({time_since_update}s since last update)")
         
@@ -333,17 +538,32 @@ class HydroponicAISystem:
     
     def shutdown(self):
         """Cleanup and shutdown"""
+        if self._shutdown.is_set():
+            return
         logger.info("Shutting down Hydroponic AI System...")
         
-        self.running.clear()
+        self._shutdown.set()
         
         if self.sensor_monitor:
             self.sensor_monitor.disconnect()
         
         if self.mqtt_client:
             self.mqtt_client.loop_stop()
+        
+        with self._pending_lock:
+            if self._batch_timer is not None:
+                self._batch_timer.cancel()
+        
+        # Let a running analysis finish (it may still publish), drop queued ones
+        self._analysis_pool.shutdown(wait=True, cancel_futures=True)
+        if self.image_analyzer_pool:
+            self.image_analyzer_pool.shutdown(wait=True, cancel_futures=True)
+        
+        if self.mqtt_client:
             self.mqtt_client.disconnect()
         
+        self._save_state()
+        
         logger.info("Shutdown complete")
 
 
@@ -8,12 +8,14 @@ Part of the Dual Tower Hydroponic AI System
 """
 
 import os
+import mmap
+import signal
 import cv2
 import numpy as np
 from pathlib import Path
 from datetime import datetime
 import logging
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, NamedTuple, Tuple, Optional, Union
 
 # TensorFlow Lite
 try:
@@ -25,12 +27,49 @@ except ImportError:
         tflite = None
         logging.warning("TensorFlow Lite not available - running in mock mode")
 
+# Numba (optional) - fused single-pass color analysis
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
 logger = logging.getLogger('image_analyzer')
 
+# OpenCV T-API: run the color pass on an OpenCL GPU when OpenCV has one.
+# CPU-only OpenCL devices are skipped; the numba/CPU paths beat them.
+def _have_opencl_gpu() -> bool:
+    try:
+        if not cv2.ocl.haveOpenCL():
+            return False
+        cv2.ocl.setUseOpenCL(True)
+        return cv2.ocl.Device.getDefault().type() == cv2.ocl.Device_TYPE_GPU
+    except cv2.error:
+        return False
+
+HAVE_OPENCL_GPU = _have_opencl_gpu()
+
+# An image file on disk, or encoded JPEG bytes already in memory
+ImageSource = Union[Path, bytes]
+
+class Deficiency(NamedTuple):
+    """One detected issue (ML class, color range or IR signal)"""
+    type: str
+    confidence: float
+    method: str
+    detail: str = ''
+
 # Model path
 MODEL_DIR = Path(__file__).parent.parent / 'models'
 MODEL_PATH = MODEL_DIR / 'plant_deficiency_model.tflite'
 
+# Frames are shrunk to this long edge before analysis; the color ratios
+# and IR thresholds are per-area measures and don't need full resolution
+ANALYSIS_MAX_EDGE = 512
+
+# Interpreter threads for the XNNPACK CPU kernels (Pi 5 has 4 cores)
+TFLITE_NUM_THREADS = 4
+
 # Deficiency detection classes (example - customize based on your model)
 DEFICIENCY_CLASSES = {
     0: 'healthy',
@@ -43,6 +82,66 @@ DEFICIENCY_CLASSES = {
     7: 'bolting_flowering'  # Overripe
 }
 
+# ML confidence above which the rule-based color/IR stages are skipped
+ML_CONFIDENT_THRESHOLD = 0.9
+
+# Class name by output index (None for indices the model has but we don't name)
+DEFICIENCY_NAMES = [DEFICIENCY_CLASSES.get(i) for i in range(max(DEFICIENCY_CLASSES) + 1)]
+
+# HSV ranges (OpenCV 8-bit scale: H 0-180, S/V 0-255) for rule-based color analysis
+# Rows: yellow (nitrogen), brown (calcium tip burn), purple (phosphorus)
+COLOR_LOWER = np.array([[20, 100, 100], [10, 50, 50], [130, 50, 50]], dtype=np.int32)
+COLOR_UPPER = np.array([[30, 255, 255], [20, 200, 200], [160, 255, 255]], dtype=np.int32)
+
+# Fixed-point divide tables used by OpenCV's 8-bit BGR->HSV conversion
+HSV_SHIFT = 12
+_SDIV = np.array([0] + [round((255 << HSV_SHIFT) / v) for v in range(1, 256)], dtype=np.int64)
+_HDIV = np.array([0] + [round((180 << HSV_SHIFT) / (6 * d)) for d in range(1, 256)], dtype=np.int64)
+
+if HAVE_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _hsv_range_counts(bgr, lower, upper, sdiv, hdiv):
+        """
+        Count pixels of a BGR image inside each HSV range, in one pass
+        
+        Converts each pixel exactly as cv2.cvtColor(..., COLOR_BGR2HSV) does
+        for 8-bit images and applies cv2.inRange semantics (inclusive bounds),
+        without materialising the HSV image or any masks.
+        """
+        rows = bgr.shape[0]
+        cols = bgr.shape[1]
+        n_ranges = lower.shape[0]
+        half = 1 << (HSV_SHIFT - 1)
+        row_counts = np.zeros((rows, n_ranges), dtype=np.int64)
+        
+        for i in prange(rows):
+            for j in range(cols):
+                b = np.int64(bgr[i, j, 0])
+                g = np.int64(bgr[i, j, 1])
+                r = np.int64(bgr[i, j, 2])
+                
+                v = max(r, g, b)
+                diff = v - min(r, g, b)
+                s = (diff * sdiv[v] + half) >> HSV_SHIFT
+                
+                if v == r:
+                    h = g - b
+                elif v == g:
+                    h = b - r + 2 * diff
+                else:
+                    h = r - g + 4 * diff
+                h = (h * hdiv[diff] + half) >> HSV_SHIFT
+                if h < 0:
+                    h += 180
+                
+                for k in range(n_ranges):
+                    if (lower[k, 0] <= h <= upper[k, 0] and
+                            lower[k, 1] <= s <= upper[k, 1] and
+                            lower[k, 2] <= v <= upper[k, 2]):
+                        row_counts[i, k] += 1
+        
+        return row_counts.sum(axis=0)
+
 # Deficiency to nutrient mapping
 DEFICIENCY_SOLUTIONS = {
     'nitrogen_deficiency': {
@@ -83,6 +182,26 @@ class ImageAnalyzer:
         self.output_details = None
         self.model_loaded = False
         
+        # Optional accelerator: path to a TFLite external delegate library
+        self.delegate_path = os.getenv('TFLITE_DELEGATE', '')
+        
+        # Quantized models: uint8 pixel -> input tensor value, and output dequantization
+        self._input_lut = None
+        self._output_quant = None
+        
+        # Zero-copy tensor accessors and preprocessing scratch (set by _load_model)
+        self._input_tensor = None
+        self._output_tensor = None
+        self._tile_bgr = None
+        self._tile_rgb = None
+        
+        # Current interpreter batch size, and whether the model can be resized
+        self._batch_size = 1
+        self._batching = True
+        
+        # Reusable color masks for the OpenCV path, per frame size
+        self._masks = {}
+        
         # Load model if available
         if tflite and MODEL_PATH.exists():
             self._load_model()
@@ -92,12 +211,36 @@ class ImageAnalyzer:
     def _load_model(self):
         """Load TensorFlow Lite model"""
         try:
-            self.model = tflite.Interpreter(model_path=str(MODEL_PATH))
+            self.model = self._create_interpreter()
             self.model.allocate_tensors()
             
             self.input_details = self.model.get_input_details()
             self.output_details = self.model.get_output_details()
             
+            # INT8/UINT8 models take pixels through a 256-entry table that folds
+            # the /255 normalisation and the input scale/zero-point together
+            input_dtype = self.input_details[0]['dtype']
+            scale, zero_point = self.input_details[0]['quantization']
+            if np.issubdtype(input_dtype, np.integer) and scale:
+                limits = np.iinfo(input_dtype)
+                levels = np.round(np.arange(256) / 255.0 / scale + zero_point)
+                self._input_lut = np.clip(levels, limits.min, limits.max).astype(input_dtype)
+            
+            # Accessors return numpy views of the interpreter's own IO buffers.
+            # Only the accessors are kept: invoke() refuses to run while any
+            # view is alive, so views are taken and dropped per inference.
+            self._input_tensor = self.model.tensor(self.input_details[0]['index'])
+            self._output_tensor = self.model.tensor(self.output_details[0]['index'])
+            
+            input_height, input_width = self.input_details[0]['shape'][1:3]
+            self._tile_bgr = np.empty((input_height, input_width, 3), dtype=np.uint8)
+            self._tile_rgb = np.empty_like(self._tile_bgr)
+            
+            output_dtype = self.output_details[0]['dtype']
+            scale, zero_point = self.output_details[0]['quantization']
+            if np.issubdtype(output_dtype, np.integer) and scale:
+                self._output_quant = (scale, zero_point)
+            
             self.model_loaded = True
             logger.info(f"Loaded TFLite model from {MODEL_PATH}")
             
@@ -105,51 +248,104 @@ class ImageAnalyzer:
             logger.error(f"Failed to load model: {e}")
             self.model_loaded = False
     
-    def analyze_images(self, visible_path: Path, noir_path: Optional[Path], tower: str) -> Dict:
+    def _create_interpreter(self):
+        """TFLite interpreter on the configured delegate, or on the CPU"""
+        if self.delegate_path:
+            try:
+                load_delegate = getattr(tflite, 'load_delegate', None) or tflite.experimental.load_delegate
+                delegate = load_delegate(self.delegate_path)
+                interpreter = tflite.Interpreter(model_path=str(MODEL_PATH),
+                                                 experimental_delegates=[delegate],
+                                                 num_threads=TFLITE_NUM_THREADS)
+                logger.info(f"TFLite inference delegated to {self.delegate_path}")
+                return interpreter
+            except Exception as e:
+                logger.warning(f"Delegate {self.delegate_path} unavailable, using CPU: {e}")
+        
+        return tflite.Interpreter(model_path=str(MODEL_PATH),
+                                  num_threads=TFLITE_NUM_THREADS)
+    
+    def analyze_images(self, visible_path: ImageSource, noir_path: Optional[ImageSource],
+                       tower: str) -> Dict:
         """
         Analyze visible and NOIR images for plant health
         
         Args:
-            visible_path: Path to visible spectrum image
-            noir_path: Path to NOIR (IR) image (optional)
+            visible_path: Path to (or JPEG bytes of) visible spectrum image
+            noir_path: Path to (or JPEG bytes of) NOIR (IR) image (optional)
             tower: Tower name ('cool' or 'warm')
         
         Returns:
             Dictionary with analysis results
         """
-        results = {
-            'timestamp': datetime.now().isoformat(),
-            'tower': tower,
-            'deficiencies': [],
-            'health_score': 100,
-            'issues': [],
-            'suggestions': []
-        }
-        
-        # Load visible image
-        visible_img = self._load_image(visible_path)
-        if visible_img is None:
-            logger.error(f"Failed to load visible image: {visible_path}")
-            return results
-        
-        # Load NOIR image if provided
-        noir_img = None
-        if noir_path and noir_path.exists():
-            noir_img = self._load_image(noir_path)
-        
-        # ML-based detection (if model available)
-        if self.model_loaded:
-            ml_results = self._ml_detect_deficiency(visible_img)
-            results['deficiencies'].extend(ml_results)
-        
-        # Rule-based color analysis
-        color_results = self._color_analysis(visible_img, tower)
-        results['deficiencies'].extend(color_results)
-        
-        # IR analysis for heat stress (if NOIR image available)
-        if noir_img is not None:
-            ir_results = self._ir_analysis(noir_img, visible_img)
-            results['deficiencies'].extend(ir_results)
+        return self.analyze_batch([(tower, visible_path, noir_path)])[0]
+    
+    def analyze_batch(self, items: List[Tuple[str, ImageSource, Optional[ImageSource]]]) -> List[Dict]:
+        """
+        Analyze several towers' images, sharing one ML inference
+        
+        Args:
+            items: (tower, visible image, NOIR image or None) per tower
+        
+        Returns:
+            Analysis results per item, in the same order
+        """
+        timestamp = datetime.now().isoformat()
+        batch = []
+        
+        for tower, visible_path, noir_path in items:
+            results = {
+                'timestamp': timestamp,
+                'tower': tower,
+                'deficiencies': [],
+                'health_score': 100,
+                'issues': [],
+                'suggestions': []
+            }
+            
+            # Load visible image
+            visible_img = self._load_image(visible_path)
+            if visible_img is None:
+                logger.error(f"Failed to load visible image: {self._describe(visible_path)}")
+            
+            # Load NOIR image if provided
+            noir_img = None
+            if visible_img is not None and (
+                    isinstance(noir_path, bytes) or (noir_path and noir_path.exists())):
+                noir_img = self._load_image(noir_path)
+            
+            batch.append((results, visible_img, noir_img))
+        
+        # ML-based detection (if model available), one invoke for every visible image
+        loaded = [entry for entry in batch if entry[1] is not None]
+        confident = [False] * len(loaded)
+        if self.model_loaded and loaded:
+            predictions = self._ml_predict_batch([visible_img for _, visible_img, _ in loaded])
+            for i, ((results, _, _), row) in enumerate(zip(loaded, predictions)):
+                results['deficiencies'].extend(self._ml_deficiencies(row))
+                confident[i] = bool(row[:len(DEFICIENCY_NAMES)].max() > ML_CONFIDENT_THRESHOLD)
+        
+        for (results, visible_img, noir_img), ml_confident in zip(loaded, confident):
+            self._finish_analysis(results, visible_img, noir_img, ml_confident)
+        
+        return [results for results, _, _ in batch]
+    
+    def _finish_analysis(self, results: Dict, visible_img: np.ndarray,
+                         noir_img: Optional[np.ndarray], ml_confident: bool = False):
+        """Run the rule-based stages and fill in score and recommendations"""
+        tower = results['tower']
+        
+        # The rule-based stages are a weaker signal; skip them when the model
+        # is already confident (in a deficiency or in 'healthy')
+        if not ml_confident:
+            # Rule-based color analysis
+            color_results = self._color_analysis(visible_img, tower)
+            results['deficiencies'].extend(color_results)
+            
+            # IR analysis for heat stress (if NOIR image available)
+            if noir_img is not None:
+                ir_results = self._ir_analysis(noir_img, visible_img)
+                results['deficiencies'].extend(ir_results)
         
         # Calculate health score
         results['health_score'] = self._calculate_health_score(results['deficiencies'])
@@ -158,147 +354,219 @@ class ImageAnalyzer:
         results['issues'], results['suggestions'] = self._generate_recommendations(
             results['deficiencies'], tower
         )
-        
-        return results
     
-    def _load_image(self, image_path: Path) -> Optional[np.ndarray]:
-        """Load and preprocess image"""
+    @staticmethod
+    def _describe(source: ImageSource) -> str:
+        """Short label for an image source in log messages"""
+        if isinstance(source, bytes):
+            return f"<{len(source)} byte JPEG>"
+        return str(source)
+    
+    def _load_image(self, image_path: ImageSource) -> Optional[np.ndarray]:
+        """Load image in OpenCV's native BGR layout, downsampled for analysis"""
         try:
-            img = cv2.imread(str(image_path))
+            if isinstance(image_path, bytes):
+                img = cv2.imdecode(np.frombuffer(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+            else:
+                # Decode straight from the page cache rather than a read() copy
+                with open(image_path, 'rb') as f, \
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    buf = np.frombuffer(mapped, dtype=np.uint8)
+                    img = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+                    del buf  # release the export so the map can close
             if img is None:
                 return None
-            return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            
+            scale = ANALYSIS_MAX_EDGE / max(img.shape[:2])
+            if scale < 1.0:
+                img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            return img
         except Exception as e:
-            logger.error(f"Error loading image {image_path}: {e}")
+            logger.error(f"Error loading image {self._describe(image_path)}: {e}")
             return None
     
-    def _ml_detect_deficiency(self, image: np.ndarray) -> List[Dict]:
+    def _ml_detect_deficiency(self, image: np.ndarray) -> List[Deficiency]:
         """Use TFLite model to detect deficiencies"""
+        return self._ml_deficiencies(self._ml_predict_batch([image])[0])
+    
+    def _set_batch_size(self, size: int) -> bool:
+        """Resize the interpreter's input batch; False if the model can't batch"""
+        if size == self._batch_size:
+            return True
+        if size > 1 and not self._batching:
+            return False
+        
+        input_height, input_width = self._tile_bgr.shape[:2]
+        try:
+            self.model.resize_tensor_input(self.input_details[0]['index'],
+                                           [size, input_height, input_width, 3])
+            self.model.allocate_tensors()
+            self._batch_size = size
+            return True
+        except Exception as e:
+            # Fixed-batch model: stay on single-image inference
+            logger.warning(f"Model does not support batch size {size}, inferring one image at a time: {e}")
+            self._batching = False
+            self.model.resize_tensor_input(self.input_details[0]['index'],
+                                           [1, input_height, input_width, 3])
+            self.model.allocate_tensors()
+            self._batch_size = 1
+            return False
+    
+    def _ml_predict_batch(self, images: List[np.ndarray]) -> np.ndarray:
+        """Class probabilities for several images from a single TFLite invoke"""
         try:
-            # Get input shape from model
-            input_shape = self.input_details[0]['shape']
-            input_height, input_width = input_shape[1], input_shape[2]
+            if not self._set_batch_size(len(images)):
+                return np.concatenate([self._ml_predict_batch([image]) for image in images])
             
-            # Resize and preprocess
-            img_resized = cv2.resize(image, (input_width, input_height))
-            img_normalized = img_resized.astype(np.float32) / 255.0
-            img_batch = np.expand_dims(img_normalized, axis=0)
+            # Resize and preprocess each image straight into its slot of the
+            # interpreter's input buffer (model expects RGB; convert the tile only)
+            input_height, input_width = self._tile_bgr.shape[:2]
+            input_buf = self._input_tensor()
+            for slot, image in enumerate(images):
+                cv2.resize(image, (input_width, input_height), dst=self._tile_bgr)
+                cv2.cvtColor(self._tile_bgr, cv2.COLOR_BGR2RGB, dst=self._tile_rgb)
+                if self._input_lut is not None:
+                    np.take(self._input_lut, self._tile_rgb, out=input_buf[slot])
+                else:
+                    np.multiply(self._tile_rgb, np.float32(1.0 / 255.0), out=input_buf[slot])
+            del input_buf
             
             # Run inference
-            self.model.set_tensor(self.input_details[0]['index'], img_batch)
             self.model.invoke()
             
-            # Get predictions
-            output_data = self.model.get_tensor(self.output_details[0]['index'])
-            predictions = output_data[0]
-            
-            # Get top predictions (confidence > 0.5)
-            deficiencies = []
-            for idx, confidence in enumerate(predictions):
-                if confidence > 0.5 and idx in DEFICIENCY_CLASSES:
-                    class_name = DEFICIENCY_CLASSES[idx]
-                    if class_name != 'healthy':
-                        deficiencies.append({
-                            'type': class_name,
-                            'confidence': float(confidence),
-                            'method': 'ml_detection'
-                        })
+            # Get predictions (copied out so no view outlives this call)
+            output = self._output_tensor()
+            if self._output_quant is not None:
+                scale, zero_point = self._output_quant
+                predictions = (output.astype(np.float32) - zero_point) * scale
+            else:
+                predictions = output.copy()
+            del output
             
-            return deficiencies
+            return predictions
             
         except Exception as e:
             logger.error(f"ML detection error: {e}")
-            return []
+            return np.zeros((len(images), len(DEFICIENCY_NAMES)), dtype=np.float32)
     
-    def _color_analysis(self, image: np.ndarray, tower: str) -> List[Dict]:
-        """Rule-based color analysis for deficiencies"""
+    def _ml_deficiencies(self, predictions: np.ndarray) -> List[Deficiency]:
+        """Deficiencies from one image's class probabilities"""
+        # Get top predictions (confidence > 0.5), among the classes we name
         deficiencies = []
+        hits = np.flatnonzero(predictions[:len(DEFICIENCY_NAMES)] > 0.5)
+        for idx in hits:
+            class_name = DEFICIENCY_NAMES[idx]
+            if class_name and class_name != 'healthy':
+                deficiencies.append(Deficiency(
+                    type=class_name,
+                    confidence=float(predictions[idx]),
+                    method='ml_detection'
+                ))
+        
+        return deficiencies
+    
+    def _color_ratios(self, image: np.ndarray) -> Tuple[float, float, float]:
+        """Fraction of pixels in the yellow, brown and purple HSV ranges"""
+        pixels = image.shape[0] * image.shape[1]
+        
+        if HAVE_OPENCL_GPU:
+            # cvtColor, inRange and countNonZero all dispatch to OpenCL on UMats
+            u_hsv = cv2.cvtColor(cv2.UMat(image), cv2.COLOR_BGR2HSV)
+            return tuple(cv2.countNonZero(cv2.inRange(u_hsv, lower, upper)) / pixels
+                         for lower, upper in zip(COLOR_LOWER, COLOR_UPPER))
+        
+        if HAVE_NUMBA:
+            counts = _hsv_range_counts(image, COLOR_LOWER, COLOR_UPPER, _SDIV, _HDIV)
+            return tuple(float(count) / pixels for count in counts)
         
         # Convert to HSV for better color detection
-        hsv = cv2.cvtColor(cv2.cvtColor(image, cv2.COLOR_RGB2BGR), cv2.COLOR_BGR2HSV)
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
         
-        # Define color ranges (HSV)
-        # Yellow (nitrogen deficiency)
-        yellow_lower = np.array([20, 100, 100])
-        yellow_upper = np.array([30, 255, 255])
-        yellow_mask = cv2.inRange(hsv, yellow_lower, yellow_upper)
-        yellow_ratio = np.sum(yellow_mask > 0) / yellow_mask.size
+        masks = self._masks.get(hsv.shape[:2])
+        if masks is None:
+            masks = self._masks[hsv.shape[:2]] = [
+                np.empty(hsv.shape[:2], dtype=np.uint8) for _ in COLOR_LOWER
+            ]
+        
+        ratios = []
+        for lower, upper, mask in zip(COLOR_LOWER, COLOR_UPPER, masks):
+            cv2.inRange(hsv, lower, upper, dst=mask)
+            ratios.append(cv2.countNonZero(mask) / pixels)
+        return tuple(ratios)
+    
+    def _color_analysis(self, image: np.ndarray, tower: str) -> List[Deficiency]:
+        """Rule-based color analysis for deficiencies"""
+        deficiencies = []
         
+        yellow_ratio, brown_ratio, purple_ratio = self._color_ratios(image)
+        
+        # Yellow (nitrogen deficiency)
         if yellow_ratio > 0.15:  # >15% yellowing
-            deficiencies.append({
-                'type': 'nitrogen_deficiency',
-                'confidence': min(yellow_ratio * 3, 1.0),
-                'method': 'color_analysis',
-                'detail': f'Yellowing detected: {yellow_ratio*100:.1f}% of leaf area'
-            })
+            deficiencies.append(Deficiency(
+                type='nitrogen_deficiency',
+                confidence=min(yellow_ratio * 3, 1.0),
+                method='color_analysis',
+                detail=f'Yellowing detected: {yellow_ratio*100:.1f}% of leaf area'
+            ))
         
         # Brown (tip burn - calcium deficiency)
-        brown_lower = np.array([10, 50, 50])
-        brown_upper = np.array([20, 200, 200])
-        brown_mask = cv2.inRange(hsv, brown_lower, brown_upper)
-        brown_ratio = np.sum(brown_mask > 0) / brown_mask.size
-        
         if brown_ratio > 0.05 and tower == 'cool':  # Tip burn common in lettuce
-            deficiencies.append({
-                'type': 'calcium_deficiency',
-                'confidence': min(brown_ratio * 5, 1.0),
-                'method': 'color_analysis',
-                'detail': f'Tip burn detected: {brown_ratio*100:.1f}% of leaf area'
-            })
+            deficiencies.append(Deficiency(
+                type='calcium_deficiency',
+                confidence=min(brown_ratio * 5, 1.0),
+                method='color_analysis',
+                detail=f'Tip burn detected: {brown_ratio*100:.1f}% of leaf area'
+            ))
         
         # Purple (phosphorus deficiency)
-        purple_lower = np.array([130, 50, 50])
-        purple_upper = np.array([160, 255, 255])
-        purple_mask = cv2.inRange(hsv, purple_lower, purple_upper)
-        purple_ratio = np.sum(purple_mask > 0) / purple_mask.size
-        
         if purple_ratio > 0.08:  # >8% purple
-            deficiencies.append({
-                'type': 'phosphorus_deficiency',
-                'confidence': min(purple_ratio * 4, 1.0),
-                'method': 'color_analysis',
-                'detail': f'Purple veining: {purple_ratio*100:.1f}% of leaf area'
-            })
+            deficiencies.append(Deficiency(
+                type='phosphorus_deficiency',
+                confidence=min(purple_ratio * 4, 1.0),
+                method='color_analysis',
+                detail=f'Purple veining: {purple_ratio*100:.1f}% of leaf area'
+            ))
         
         return deficiencies
     
-    def _ir_analysis(self, noir_img: np.ndarray, visible_img: np.ndarray) -> List[Dict]:
+    def _ir_analysis(self, noir_img: np.ndarray, visible_img: np.ndarray) -> List[Deficiency]:
         """Analyze NOIR (IR) image for heat stress"""
         issues = []
         
         try:
             # Convert to grayscale
-            noir_gray = cv2.cvtColor(cv2.cvtColor(noir_img, cv2.COLOR_RGB2BGR), 
-                                     cv2.COLOR_BGR2GRAY)
+            noir_gray = cv2.cvtColor(noir_img, cv2.COLOR_BGR2GRAY)
             
-            # Analyze temperature variance (brighter = warmer in IR)
-            mean_temp = np.mean(noir_gray)
-            std_temp = np.std(noir_gray)
+            # Analyze temperature variance (brighter = warmer in IR), one pass
+            mean_arr, std_arr = cv2.meanStdDev(noir_gray)
+            mean_temp = float(mean_arr[0, 0])
+            std_temp = float(std_arr[0, 0])
             
             # High variance suggests uneven heating (stress)
             if std_temp > 40:  # Threshold for variance
-                issues.append({
-                    'type': 'heat_stress',
-                    'confidence': min(std_temp / 60, 1.0),
-                    'method': 'ir_analysis',
-                    'detail': f'Uneven heat distribution detected (IR variance: {std_temp:.1f})'
-                })
+                issues.append(Deficiency(
+                    type='heat_stress',
+                    confidence=min(std_temp / 60, 1.0),
+                    method='ir_analysis',
+                    detail=f'Uneven heat distribution detected (IR variance: {std_temp:.1f})'
+                ))
             
             # Very high average brightness = overall heat stress
             if mean_temp > 180:  # High IR brightness
-                issues.append({
-                    'type': 'overall_heat_stress',
-                    'confidence': min((mean_temp - 180) / 75, 1.0),
-                    'method': 'ir_analysis',
-                    'detail': f'High IR brightness: {mean_temp:.1f} - possible heat stress'
-                })
+                issues.append(Deficiency(
+                    type='overall_heat_stress',
+                    confidence=min((mean_temp - 180) / 75, 1.0),
+                    method='ir_analysis',
+                    detail=f'High IR brightness: {mean_temp:.1f} - possible heat stress'
+                ))
         
         except Exception as e:
             logger.error(f"IR analysis error: {e}")
         
         return issues
     
-    def _calculate_health_score(self, deficiencies: List[Dict]) -> int:
+    def _calculate_health_score(self, deficiencies: List[Deficiency]) -> int:
         """Calculate overall plant health score (0-100)"""
         if not deficiencies:
             return 100
@@ -306,10 +574,10 @@ class ImageAnalyzer:
         # Deduct points based on deficiency confidence
         score = 100
         for deficiency in deficiencies:
-            confidence = deficiency.get('confidence', 0.5)
+            confidence = deficiency.confidence
             
             # Critical issues (harvest, bolting)
-            if deficiency['type'] in ['bolting_flowering', 'ready_for_harvest']:
+            if deficiency.type in ['bolting_flowering', 'ready_for_harvest']:
                 score -= int(confidence * 5)  # Minor deduction
             else:
                 # Deficiencies
@@ -317,14 +585,14 @@ class ImageAnalyzer:
         
         return max(score, 0)
     
-    def _generate_recommendations(self, deficiencies: List[Dict], tower: str) -> Tuple[List[str], List[str]]:
+    def _generate_recommendations(self, deficiencies: List[Deficiency], tower: str) -> Tuple[List[str], List[str]]:
         """Generate actionable issues and suggestions"""
         issues = []
         suggestions = []
         
         for deficiency in deficiencies:
-            deficiency_type = deficiency['type']
-            confidence = deficiency.get('confidence', 0.5)
+            deficiency_type = deficiency.type
+            confidence = deficiency.confidence
             
             # Only include if confidence is high enough
             if confidence < 0.4:
@@ -332,7 +600,7 @@ class ImageAnalyzer:
             
             # Format issue
             issue_text = deficiency_type.replace('_', ' ').title()
-            detail = deficiency.get('detail', '')
+            detail = deficiency.detail
             if detail:
                 issue_text += f" ({detail})"
             issues.append(issue_text)
@@ -349,6 +617,27 @@ class ImageAnalyzer:
         return issues, suggestions
 
 
+# Analysis worker process: one ImageAnalyzer (interpreter, tensors, scratch
+# buffers) per process, built once by the pool initializer
+_worker_analyzer = None
+
+def init_analysis_worker():
+    """ProcessPoolExecutor initializer - load the model in the worker"""
+    global _worker_analyzer
+    
+    # Ctrl+C is for the parent; it shuts the pool down cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_analyzer = ImageAnalyzer()
+
+def analysis_worker_model_loaded() -> bool:
+    """Whether the worker's analyzer has the TFLite model"""
+    return _worker_analyzer.model_loaded
+
+def run_analysis_batch(items: List[Tuple[str, ImageSource, Optional[ImageSource]]]) -> List[Dict]:
+    """ImageAnalyzer.analyze_batch() on the worker's analyzer"""
+    return _worker_analyzer.analyze_batch(items)
+
+
 # Create placeholder model file if it doesn't exist
 def create_placeholder_model():
     """Create a placeholder TFLite model file for development"""
@@ -12,12 +12,18 @@ Features:
 """
 
 import os
-import json
+import errno
+import math
+import queue
 import logging
+import shutil
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, Tuple, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Optional
 from pathlib import Path
+import orjson
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 import cv2
@@ -31,6 +37,64 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Captures are shrunk to this long edge for the color metrics (brightness,
+# plant coverage), which are per-area ratios; the color decode itself is done
+# at 1/4 scale by the JPEG decoder. Blur stays at full resolution, from a
+# luma-only decode: Laplacian variance grows sharply when an image is
+# downsampled.
+SCORING_MAX_EDGE = 640
+
+# Scored rows are written in batches: one transaction per this many images,
+# or after this many seconds, whichever comes first
+DB_BATCH_SIZE = 16
+DB_FLUSH_SECONDS = 5.0
+
+# Rows fetched per query while archiving/deleting old images
+CLEANUP_BATCH_SIZE = 500
+
+# Archiving: files below this size are moved as they are; larger ones are
+# re-encoded at quality 75 with 4:2:0 chroma
+ARCHIVE_REENCODE_MIN_BYTES = 512 * 1024
+ARCHIVE_JPEG_PARAMS = [
+    cv2.IMWRITE_JPEG_QUALITY, 75,
+    cv2.IMWRITE_JPEG_OPTIMIZE, 1,
+    cv2.IMWRITE_JPEG_PROGRESSIVE, 0,
+    cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+]
+
+# Quality score descriptions, for scores 1-10
+RATING_DESCRIPTIONS = (
+    "Unusable",
+    "Very Poor",
+    "Poor",
+    "Below Average",
+    "Average",
+    "Above Average",
+    "Good",
+    "Very Good",
+    "Excellent",
+    "Perfect"
+)
+
+# HSV range counted as plant matter (OpenCV scale; adjust for grow lights)
+GREEN_LOWER = np.array([30, 40, 40], dtype=np.uint8)
+GREEN_UPPER = np.array([90, 255, 255], dtype=np.uint8)
+
+def _brightness_band_score(mean_brightness: float) -> int:
+    """Score a mean brightness (0-100%): best at 40-60%, less the further off"""
+    if 40 <= mean_brightness <= 60:
+        return 100
+    elif 30 <= mean_brightness < 40 or 60 < mean_brightness <= 70:
+        return 80
+    elif 20 <= mean_brightness < 30 or 70 < mean_brightness <= 80:
+        return 60
+    else:
+        return 40
+
+# Band score per whole percent. Bands below 50% are closed on the left and
+# above 50% on the right, so floor/ceil of the mean picks the exact band.
+BRIGHTNESS_SCORES = np.array([_brightness_band_score(pct) for pct in range(101)], dtype=np.float32)
+
 class ImageQualityScorer:
     def __init__(self, db_path="/home/pi/hydro_data/images.db"):
         self.db_path = db_path
@@ -56,21 +120,58 @@ class ImageQualityScorer:
         # Initialize database
         self._init_database()
         
+        # Scored rows waiting for the next batched write
+        self._pending_rows = []
+        self._flush_timer = None
+        
+        # Scoring runs off the MQTT network thread; two workers so one image's
+        # decode/metrics overlap the next one's file I/O
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='scorer')
+        
+        # Each image's color metrics run on a helper thread alongside its luma
+        # stats (OpenCV releases the GIL). 2 scorers x 2 branches fill the
+        # Pi 5's four cores, so OpenCV's own worker threads would only
+        # oversubscribe them.
+        self._metrics_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='metrics')
+        cv2.setNumThreads(1)
+        
         # MQTT client
         self.client = mqtt.Client()
         self.client.username_pw_set(self.username, self.password)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         
+        # Results are published from one writer thread, so a slow broker
+        # never holds up a scoring worker; None stops it
+        self._publish_queue = queue.SimpleQueue()
+        self._publisher = threading.Thread(target=self._publish_loop, name='scorer-publish', daemon=True)
+        self._publisher.start()
+        
         logger.info("Image Quality Scorer initialized")
     
     def _init_database(self):
         """Initialize image metadata database"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # One long-lived connection; inserts are batched (see _queue_insert)
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        
+        cursor.execute("BEGIN")
         
+        # Older databases stored capture_date as ISO text; rebuild those in place
+        columns = {row[1]: row[2] for row in cursor.execute("PRAGMA table_info(images)")}
+        legacy = columns.get("capture_date", "").upper() == "TEXT"
+        if legacy:
+            logger.info("Migrating images to integer timestamps")
+            cursor.execute("ALTER TABLE images RENAME TO images_legacy")
+        
+        # capture_date is unix epoch seconds
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS images (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -78,7 +179,7 @@ class ImageQualityScorer:
                 filepath TEXT NOT NULL,
                 tower TEXT NOT NULL,
                 camera_type TEXT NOT NULL,
-                capture_date TEXT NOT NULL,
+                capture_date INTEGER NOT NULL,
                 quality_score INTEGER,
                 blur_score REAL,
                 brightness_score REAL,
@@ -92,106 +193,145 @@ class ImageQualityScorer:
             )
         ''')
         
-        conn.commit()
-        conn.close()
+        if legacy:
+            # Legacy timestamps are naive local time
+            cursor.execute('''
+                INSERT INTO images
+                (id, filename, filepath, tower, camera_type, capture_date, quality_score,
+                 blur_score, brightness_score, contrast_score, plant_coverage,
+                 is_harvest_photo, is_perfect, archived, deleted, created_at)
+                SELECT id, filename, filepath, tower, camera_type,
+                       CAST(strftime('%s', capture_date, 'utc') AS INTEGER), quality_score,
+                       blur_score, brightness_score, contrast_score, plant_coverage,
+                       is_harvest_photo, is_perfect, archived, deleted, created_at
+                FROM images_legacy
+            ''')
+            cursor.execute("DROP TABLE images_legacy")
+        
+        # Retention queries in cleanup_old_images: flag equality, then date range
+        # (index order also serves their ORDER BY capture_date, id)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_images_cleanup
+            ON images(archived, deleted, is_perfect, is_harvest_photo, capture_date)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_images_harvest
+            ON images(is_harvest_photo, deleted, capture_date)
+        ''')
+        
+        cursor.execute("COMMIT")
+        
         logger.info(f"Image database initialized at {self.db_path}")
     
-    def calculate_blur_score(self, image_path: str) -> float:
+    def _queue_insert(self, row: Tuple):
+        """Queue an images row; written with the next batch"""
+        with self._lock:
+            self._pending_rows.append(row)
+            flush_now = len(self._pending_rows) >= DB_BATCH_SIZE
+            if not flush_now and self._flush_timer is None:
+                self._flush_timer = threading.Timer(DB_FLUSH_SECONDS, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        
+        if flush_now:
+            self.flush()
+    
+    def flush(self):
+        """Write all queued images rows in one transaction"""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            rows, self._pending_rows = self._pending_rows, []
+            if not rows:
+                return
+            
+            try:
+                self.conn.execute("BEGIN")
+                for row in rows:
+                    try:
+                        self.conn.execute('''
+                            INSERT INTO images 
+                            (filename, filepath, tower, camera_type, capture_date, quality_score,
+                             blur_score, brightness_score, contrast_score, plant_coverage,
+                             is_harvest_photo, is_perfect)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ''', row)
+                    except sqlite3.IntegrityError:
+                        logger.warning(f"Image {row[0]} already scored")
+                self.conn.execute("COMMIT")
+            except Exception as e:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                logger.error(f"Failed to store {len(rows)} image scores: {e}")
+    
+    def _grayscale_stats(self, gray: np.ndarray) -> Tuple[float, float]:
         """
-        Calculate blur score using Laplacian variance
-        Higher score = sharper image
+        Sharpness and contrast statistics of a grayscale image
+        
+        Returns:
+            (Laplacian variance, standard deviation)
         """
         try:
-            img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-            if img is None:
-                return 0.0
-            
-            # Calculate Laplacian variance
-            laplacian_var = cv2.Laplacian(img, cv2.CV_64F).var()
-            
-            # Normalize to 0-100 scale (typical sharp images: 100-500+)
-            normalized = min(100, (laplacian_var / 5.0))
-            return round(normalized, 2)
+            # Laplacian of 8-bit input spans +/-1020, so CV_16S holds it
+            # exactly at a quarter of CV_64F's bytes
+            laplacian = cv2.Laplacian(gray, cv2.CV_16S)
+            _, laplacian_std = cv2.meanStdDev(laplacian)
+            _, std_dev = cv2.meanStdDev(gray)
+            return float(laplacian_std[0, 0]) ** 2, float(std_dev[0, 0])
         
         except Exception as e:
-            logger.error(f"Error calculating blur: {e}")
-            return 0.0
+            logger.error(f"Error calculating blur/contrast: {e}")
+            return 0.0, 0.0
     
-    def calculate_brightness_score(self, image_path: str) -> float:
+    def calculate_blur_score(self, laplacian_var: float) -> float:
+        """
+        Calculate blur score from Laplacian variance
+        Higher score = sharper image
+        """
+        # Normalize to 0-100 scale (typical sharp images: 100-500+)
+        normalized = min(100, (laplacian_var / 5.0))
+        return round(normalized, 2)
+    
+    def calculate_brightness_score(self, hsv: np.ndarray) -> float:
         """
         Calculate brightness score
         Optimal range: 40-60% (returns score 80-100)
         """
         try:
-            img = cv2.imread(image_path)
-            if img is None:
-                return 0.0
-            
-            # Convert to HSV and get V channel
-            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            v_channel = hsv[:, :, 2]
-            mean_brightness = np.mean(v_channel) / 255.0 * 100  # 0-100
+            # V channel mean, taken from the per-channel means so the strided
+            # V plane isn't copied out first
+            mean_brightness = cv2.mean(hsv)[2] / 255.0 * 100  # 0-100
             
             # Score based on optimal range (40-60%)
-            if 40 <= mean_brightness <= 60:
-                score = 100
-            elif 30 <= mean_brightness < 40 or 60 < mean_brightness <= 70:
-                score = 80
-            elif 20 <= mean_brightness < 30 or 70 < mean_brightness <= 80:
-                score = 60
-            else:
-                score = 40
-            
-            return round(score, 2)
+            pct = math.floor(mean_brightness) if mean_brightness <= 50 else math.ceil(mean_brightness)
+            return round(float(BRIGHTNESS_SCORES[pct]), 2)
         
         except Exception as e:
             logger.error(f"Error calculating brightness: {e}")
             return 0.0
     
-    def calculate_contrast_score(self, image_path: str) -> float:
+    def calculate_contrast_score(self, std_dev: float) -> float:
         """
-        Calculate contrast score using standard deviation
+        Calculate contrast score from grayscale standard deviation
         Higher std dev = better contrast
         """
-        try:
-            img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-            if img is None:
-                return 0.0
-            
-            std_dev = np.std(img)
-            
-            # Normalize (typical good contrast: 40-80 std dev)
-            normalized = min(100, (std_dev / 0.8))
-            return round(normalized, 2)
-        
-        except Exception as e:
-            logger.error(f"Error calculating contrast: {e}")
-            return 0.0
+        # Normalize (typical good contrast: 40-80 std dev)
+        normalized = min(100, (std_dev / 0.8))
+        return round(normalized, 2)
     
-    def calculate_plant_coverage(self, image_path: str) -> float:
+    def calculate_plant_coverage(self, hsv: np.ndarray) -> float:
         """
         Estimate plant coverage using green pixel detection
         Returns percentage of image containing plant matter
         """
         try:
-            img = cv2.imread(image_path)
-            if img is None:
-                return 0.0
-            
-            # Convert to HSV
-            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            
-            # Green color range (adjust for grow lights)
-            lower_green = np.array([30, 40, 40])
-            upper_green = np.array([90, 255, 255])
-            
-            # Create mask
-            mask = cv2.inRange(hsv, lower_green, upper_green)
+            # Create mask of green pixels
+            mask = cv2.inRange(hsv, GREEN_LOWER, GREEN_UPPER)
             
             # Calculate coverage
-            green_pixels = np.sum(mask > 0)
-            total_pixels = mask.shape[0] * mask.shape[1]
-            coverage = (green_pixels / total_pixels) * 100
+            green_pixels = cv2.countNonZero(mask)
+            coverage = green_pixels * 100.0 / mask.size
             
             return round(coverage, 2)
         
@@ -210,17 +350,33 @@ class ImageQualityScorer:
         - Brightness: 20%
         - Contrast: 10%
         """
-        # Normalize all to 0-100 range first
+        # Inputs are 0-100; weights already include the /10 to the 1-10 scale
         weighted_score = (
-            (blur * 0.40) +
-            (coverage * 0.30) +
-            (brightness * 0.20) +
-            (contrast * 0.10)
+            (blur * 0.04) +
+            (coverage * 0.03) +
+            (brightness * 0.02) +
+            (contrast * 0.01)
         )
         
-        # Convert to 1-10 scale
-        final_score = max(1, min(10, round(weighted_score / 10)))
-        return final_score
+        return max(1, min(10, round(weighted_score)))
+    
+    def _color_scores(self, image_path: str) -> Optional[Tuple[float, float]]:
+        """
+        Brightness and plant coverage from a 1/4-scale color decode
+        
+        Returns:
+            (brightness score, plant coverage), or None if unreadable
+        """
+        img = cv2.imread(image_path, cv2.IMREAD_REDUCED_COLOR_4)
+        if img is None:
+            return None
+        
+        scale = SCORING_MAX_EDGE / max(img.shape[:2])
+        if scale < 1.0:
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        
+        return self.calculate_brightness_score(hsv), self.calculate_plant_coverage(hsv)
     
     def score_image(self, image_path: str, tower: str, camera_type: str, 
                    is_harvest: bool = False) -> Dict:
@@ -232,11 +388,23 @@ class ImageQualityScorer:
         """
         filename = os.path.basename(image_path)
         
-        # Calculate individual scores
-        blur_score = self.calculate_blur_score(image_path)
-        brightness_score = self.calculate_brightness_score(image_path)
-        contrast_score = self.calculate_contrast_score(image_path)
-        plant_coverage = self.calculate_plant_coverage(image_path)
+        # Full-size luma for blur/contrast here, 1/4-scale color for the HSV
+        # metrics on a helper thread; neither decode materializes the
+        # full-resolution BGR frame
+        color_future = self._metrics_pool.submit(self._color_scores, image_path)
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if gray is not None:
+            laplacian_var, std_dev = self._grayscale_stats(gray)
+        color_scores = color_future.result()
+        
+        if gray is None or color_scores is None:
+            logger.error(f"Could not read image {image_path}")
+            blur_score = brightness_score = contrast_score = plant_coverage = 0.0
+        else:
+            # Calculate individual scores
+            blur_score = self.calculate_blur_score(laplacian_var)
+            brightness_score, plant_coverage = color_scores
+            contrast_score = self.calculate_contrast_score(std_dev)
         
         # Overall score
         quality_score = self.calculate_overall_score(
@@ -246,39 +414,23 @@ class ImageQualityScorer:
         # Perfect image (10/10)
         is_perfect = quality_score >= self.quality_threshold
         
-        # Store in database
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO images 
-                (filename, filepath, tower, camera_type, capture_date, quality_score,
-                 blur_score, brightness_score, contrast_score, plant_coverage,
-                 is_harvest_photo, is_perfect)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (filename, image_path, tower, camera_type, datetime.now().isoformat(),
-                  quality_score, blur_score, brightness_score, contrast_score,
-                  plant_coverage, is_harvest, is_perfect))
-            
-            conn.commit()
-        except sqlite3.IntegrityError:
-            logger.warning(f"Image {filename} already scored")
-        finally:
-            conn.close()
+        # Store in database (batched)
+        self._queue_insert((filename, image_path, tower, camera_type, int(time.time()),
+                            quality_score, blur_score, brightness_score, contrast_score,
+                            plant_coverage, is_harvest, is_perfect))
         
         # Move perfect images to special directory
         if is_perfect and not is_harvest:
             new_path = os.path.join(self.perfect_path, filename)
             if image_path != new_path:
-                os.rename(image_path, new_path)
+                self._move_file(image_path, new_path)
                 logger.info(f"Moved perfect image to {new_path}")
         
         # Move harvest photos to harvest directory
         if is_harvest:
             new_path = os.path.join(self.harvest_path, filename)
             if image_path != new_path:
-                os.rename(image_path, new_path)
+                self._move_file(image_path, new_path)
                 logger.info(f"Moved harvest photo to {new_path}")
         
         result = {
@@ -293,11 +445,8 @@ class ImageQualityScorer:
             "rating": self.get_rating_description(quality_score)
         }
         
-        # Publish to MQTT
-        self.client.publish(
-            f"/{tower}/image_quality",
-            json.dumps(result)
-        )
+        # Publish to MQTT (via the writer thread)
+        self._publish_queue.put((f"/{tower}/image_quality", orjson.dumps(result)))
         
         logger.info(
             f"Image scored: {filename} = {quality_score}/10 "
@@ -307,21 +456,20 @@ class ImageQualityScorer:
         
         return result
     
+    def _move_file(self, src: str, dst: str):
+        """Move a file, copying across filesystems (e.g. SD card to USB drive)"""
+        try:
+            os.replace(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(src, dst)
+    
     def get_rating_description(self, score: int) -> str:
         """Get text description of quality score"""
-        ratings = {
-            10: "Perfect",
-            9: "Excellent",
-            8: "Very Good",
-            7: "Good",
-            6: "Above Average",
-            5: "Average",
-            4: "Below Average",
-            3: "Poor",
-            2: "Very Poor",
-            1: "Unusable"
-        }
-        return ratings.get(score, "Unknown")
+        if 1 <= score <= 10:
+            return RATING_DESCRIPTIONS[score - 1]
+        return "Unknown"
     
     def cleanup_old_images(self):
         """
@@ -331,64 +479,119 @@ class ImageQualityScorer:
         - Compress and archive other images after 30 days
         - Delete archived images after 1 year
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get images older than 30 days that aren't perfect or harvest
-        cutoff_date = (datetime.now() - timedelta(days=30)).isoformat()
-        
-        cursor.execute('''
-            SELECT id, filename, filepath, quality_score, is_harvest_photo, is_perfect
-            FROM images
-            WHERE capture_date < ? 
-            AND is_perfect = 0 
-            AND is_harvest_photo = 0
-            AND archived = 0
-            AND deleted = 0
-        ''', (cutoff_date,))
-        
-        for row in cursor.fetchall():
-            img_id, filename, filepath, score, is_harvest, is_perfect = row
+        # Newly scored images should be visible to the queries below
+        self.flush()
+        
+        # File work runs without the lock so scoring workers are not held up;
+        # each chunk's rows are committed right after its files are moved
+        
+        # Get images older than 30 days that aren't perfect or harvest,
+        # a chunk at a time (keyset on capture_date, id)
+        cutoff_date = int(time.time()) - 30 * 86400
+        last_seen = (0, 0)
+        
+        while True:
+            with self._lock:
+                rows = self.conn.execute('''
+                    SELECT id, filename, filepath, capture_date
+                    FROM images
+                    WHERE archived = 0
+                    AND deleted = 0
+                    AND is_perfect = 0 
+                    AND is_harvest_photo = 0
+                    AND capture_date < ? 
+                    AND (capture_date, id) > (?, ?)
+                    ORDER BY capture_date, id
+                    LIMIT ?
+                ''', (cutoff_date, *last_seen, CLEANUP_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            last_seen = (rows[-1][3], rows[-1][0])
             
-            if os.path.exists(filepath):
-                # Compress and move to archive
-                archive_path = os.path.join(self.archive_path, filename)
-                
-                # Simple compression using JPEG quality
-                img = cv2.imread(filepath)
-                if img is not None:
-                    cv2.imwrite(archive_path, img, [cv2.IMWRITE_JPEG_QUALITY, 75])
-                    os.remove(filepath)
+            archived = []
+            try:
+                for img_id, filename, filepath, _ in rows:
+                    if not os.path.exists(filepath):
+                        continue
+                    
+                    # Compress and move to archive
+                    archive_path = os.path.join(self.archive_path, filename)
                     
-                    # Update database
-                    cursor.execute('''
-                        UPDATE images 
-                        SET archived = 1, filepath = ?
-                        WHERE id = ?
-                    ''', (archive_path, img_id))
+                    if os.path.getsize(filepath) < ARCHIVE_REENCODE_MIN_BYTES:
+                        # Already small; re-encoding would cost more than it saves
+                        self._move_file(filepath, archive_path)
+                    else:
+                        # Simple compression using JPEG quality
+                        img = cv2.imread(filepath)
+                        if img is None:
+                            continue
+                        cv2.imwrite(archive_path, img, ARCHIVE_JPEG_PARAMS)
+                        os.remove(filepath)
                     
+                    archived.append((archive_path, img_id))
                     logger.info(f"Archived image: {filename}")
+            finally:
+                # Record whatever was moved, even if a later file failed
+                self._commit_cleanup(
+                    'UPDATE images SET archived = 1, filepath = ? WHERE id = ?', archived
+                )
         
         # Delete old harvest photos (after 5 years)
-        harvest_cutoff = (datetime.now() - timedelta(days=365 * self.harvest_retention_years)).isoformat()
-        
-        cursor.execute('''
-            SELECT id, filepath
-            FROM images
-            WHERE is_harvest_photo = 1
-            AND capture_date < ?
-            AND deleted = 0
-        ''', (harvest_cutoff,))
-        
-        for row in cursor.fetchall():
-            img_id, filepath = row
-            if os.path.exists(filepath):
-                os.remove(filepath)
-                cursor.execute('UPDATE images SET deleted = 1 WHERE id = ?', (img_id,))
-                logger.info(f"Deleted old harvest photo: {filepath}")
-        
-        conn.commit()
-        conn.close()
+        harvest_cutoff = int(time.time()) - 365 * 86400 * self.harvest_retention_years
+        last_seen = (0, 0)
+        
+        while True:
+            with self._lock:
+                rows = self.conn.execute('''
+                    SELECT id, filepath, capture_date
+                    FROM images
+                    WHERE is_harvest_photo = 1
+                    AND deleted = 0
+                    AND capture_date < ?
+                    AND (capture_date, id) > (?, ?)
+                    ORDER BY capture_date, id
+                    LIMIT ?
+                ''', (harvest_cutoff, *last_seen, CLEANUP_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            last_seen = (rows[-1][2], rows[-1][0])
+            
+            deleted = []
+            try:
+                for img_id, filepath, _ in rows:
+                    if os.path.exists(filepath):
+                        os.remove(filepath)
+                        deleted.append((img_id,))
+                        logger.info(f"Deleted old harvest photo: {filepath}")
+            finally:
+                self._commit_cleanup('UPDATE images SET deleted = 1 WHERE id = ?', deleted)
+    
+    def _commit_cleanup(self, sql: str, params: List[Tuple]):
+        """Apply one cleanup chunk's row updates in a short transaction"""
+        if not params:
+            return
+        
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(sql, params)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+    
+    def _publish_loop(self):
+        """Publish queued (topic, payload) pairs until a None sentinel"""
+        while True:
+            item = self._publish_queue.get()
+            if item is None:
+                break
+            
+            topic, payload = item
+            try:
+                self.client.publish(topic, payload)
+            except Exception as e:
+                logger.error(f"Failed to publish to {topic}: {e}")
     
     def on_connect(self, client, userdata, flags, rc):
         """MQTT connection handler"""
@@ -401,7 +604,7 @@ class ImageQualityScorer:
     def on_message(self, client, userdata, msg):
         """MQTT message handler"""
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = orjson.loads(msg.payload)
             
             image_path = payload.get("path")
             tower = payload.get("tower")
@@ -409,11 +612,18 @@ class ImageQualityScorer:
             is_harvest = payload.get("is_harvest", False)
             
             if image_path and os.path.exists(image_path):
-                self.score_image(image_path, tower, camera_type, is_harvest)
+                self._pool.submit(self._score_image_task, image_path, tower, camera_type, is_harvest)
         
         except Exception as e:
             logger.error(f"Error processing message: {e}")
     
+    def _score_image_task(self, image_path: str, tower: str, camera_type: str, is_harvest: bool):
+        """score_image() on a worker thread"""
+        try:
+            self.score_image(image_path, tower, camera_type, is_harvest)
+        except Exception as e:
+            logger.error(f"Error scoring {image_path}: {e}")
+    
     def run(self):
         """Main run loop"""
         try:
@@ -426,6 +636,11 @@ class ImageQualityScorer:
             self.client.loop_forever()
         except KeyboardInterrupt:
             logger.info("Shutting down Image Quality Scorer...")
+            self._pool.shutdown(wait=True)
+            self._metrics_pool.shutdown(wait=True)
+            self._publish_queue.put(None)
+            self._publisher.join()
+            self.flush()
             self.client.disconnect()
         except Exception as e:
             logger.error(f"Fatal error: {e}")
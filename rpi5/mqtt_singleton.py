@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Shared MQTT Client
+One paho client (one broker connection, one network thread) per process
+
+Services that run in the same process (e.g. DosingController and
+HomeAssistantBridge) take their client from get_client() and register
+their handlers with add_connect_handler() / message_callback_add(), so
+neither overwrites the other's callbacks. Start the loop once, from any
+one service's run(). load_environment() is shared by their entry points.
+"""
+
+import os
+import threading
+from typing import Callable, Dict, List
+
+_client = None
+_client_lock = threading.Lock()
+
+# client -> handlers called from that client's on_connect
+_connect_handlers: Dict[object, List[Callable]] = {}
+
+def load_environment():
+    """Load .env unless systemd already supplied the environment (EnvironmentFile=)"""
+    if not os.getenv("SYSTEMD_ENV"):
+        from dotenv import load_dotenv
+        load_dotenv()
+
+def get_client():
+    """Return the process-wide MQTT client, creating it on first use"""
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            import paho.mqtt.client as mqtt
+            _client = mqtt.Client()
+            _client.username_pw_set(
+                os.getenv("MQTT_USERNAME", "hydro_user"),
+                os.getenv("MQTT_PASSWORD", "")
+            )
+        return _client
+
+def add_connect_handler(client, handler: Callable):
+    """Call handler(client, userdata, flags, rc) on every connect of client"""
+    with _client_lock:
+        handlers = _connect_handlers.get(client)
+        if handlers is None:
+            handlers = _connect_handlers[client] = []
+
+            def on_connect(client, userdata, flags, rc):
+                for connect_handler in list(handlers):
+                    connect_handler(client, userdata, flags, rc)
+
+            client.on_connect = on_connect
+        handlers.append(handler)
@@ -7,17 +7,205 @@ Part of the Dual Tower Hydroponic AI System
 """
 
 import os
+import re
 import json
 import logging
+from functools import lru_cache
 from typing import Dict, List, Optional
 from datetime import datetime
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 load_dotenv()
 
 logger = logging.getLogger('nutrient_advisor')
 
+# Reply budget for Grok: the JSON recommendation is ~150 tokens, with
+# headroom so additional_notes isn't cut off mid-object
+GROK_MAX_TOKENS = 300
+
+# JSON object in a Grok reply: inside a ``` / ```json fence, else the
+# outermost {...} of the text
+JSON_BLOCK = re.compile(r'```(?:json)?\s*(\{.*?\})\s*```|(\{.*\})', re.DOTALL)
+
+
+# Grok user prompt, filled per query with str.format_map
+GROK_PROMPT_TEMPLATE = """You are an expert hydroponic nutrient advisor. Analyze this situation and provide a specific, actionable recommendation.
+
+Tower: {tower} ({plant_type})
+Issue: {issue_type}
+Deficiencies detected: {deficiencies}
+
+Current Sensor Data:
+- EC: {ec} mS/cm (target: {ec_min}-{ec_max})
+- pH: {ph} (target: {ph_min}-{ph_max})
+- Water Temp: {water_temp}°F
+- Air Temp: {air_temp}°F
+- Humidity: {humidity}%
+
+Available Nutrients:
+- Base: {base}
+- Buffer: {buffer}
+- Supplements: {supplements}
+- pH Down, CalMagic, Epsom Salt, Calcium Nitrate
+
+Provide recommendation in JSON format:
+{{
+    "action": "specific nutrient to add",
+    "amount": "precise amount in grams or ml",
+    "reason": "explanation based on data",
+    "priority": "low/medium/high",
+    "additional_notes": "any other relevant advice"
+}}
+
+Be specific with amounts. Consider nutrient interactions and lockouts."""
+
+
+# Local nutrient knowledge base
+NUTRIENT_DATABASE = {
+    'cool': {
+        'base': 'Lettuce Fertilizer 8-15-36',
+        'buffer': 'CalMagic + Calcium Nitrate',
+        'supplements': ['Epsom Salt', 'Armor Si', 'Hydroguard'],
+        'ec_range': (1.2, 1.8),
+        'ph_range': (5.8, 6.2),
+        'plant_type': 'lettuce/dill'
+    },
+    'warm': {
+        'base': 'MaxiGrow 10-5-14',
+        'buffer': 'CalMagic',
+        'supplements': ['Armor Si', 'Epsom Salt', 'Hydroguard'],
+        'ec_range': (1.5, 2.0),
+        'ph_range': (5.8, 6.2),
+        'plant_type': 'basil/oregano'
+    }
+}
+
+# Full fresh-reservoir mixes per tower
+FRESH_RESERVOIR_RECIPES = {
+    'cool': """Cool Tower Fresh Reservoir (5 gallons):
+1. Buffer: 5ml CalMagic + 10g Calcium Nitrate
+2. Fertilizer: 10-12g Lettuce Fertilizer 8-15-36
+3. Supplements: 5g Epsom Salt, 5ml Armor Si
+4. Mix order: Add buffers first, stir, then fertilizer/Epsom
+5. Aerate with air stones, adjust pH to 5.8-6.2
+6. Target EC: 1.2-1.8 mS/cm
+7. Wait 60min, then add 10ml Hydroguard""",
+    'warm': """Warm Tower Fresh Reservoir (5 gallons):
+1. Buffer: 5ml CalMagic
+2. Fertilizer: 10g MaxiGrow (1 big + 1 little scoop)
+3. Supplements: 5ml Armor Si, optional 1-2g Epsom Salt
+4. Stir gently, aerate with air stones
+5. Adjust pH to 5.8-6.2
+6. Target EC: 1.5-2.0 mS/cm
+7. Wait 60min, then add 10ml Hydroguard"""
+}
+
+
+@lru_cache(maxsize=256)
+def _local_recommendation_cached(tower: str, issue_type: str, ec: float, ph: float,
+                                 ec_far_over: bool) -> Dict:
+    """Rule-based recommendation for rounded readings (see NutrientAdvisor._local_recommendation)"""
+    tower_info = NUTRIENT_DATABASE[tower]
+    
+    # EC adjustments
+    if 'ec_low' in issue_type:
+        if tower == 'cool':
+            return {
+                'action': 'Add Lettuce Fertilizer 8-15-36',
+                'amount': '5-8g',
+                'reason': f'EC below target ({ec:.2f} < {tower_info["ec_range"][0]})',
+                'priority': 'medium',
+                'source': 'local'
+            }
+        else:  # warm
+            return {
+                'action': 'Add MaxiGrow (small scoop)',
+                'amount': '~5g',
+                'reason': f'EC below target ({ec:.2f} < {tower_info["ec_range"][0]})',
+                'priority': 'medium',
+                'source': 'local'
+            }
+    
+    elif 'ec_high' in issue_type:
+        return {
+            'action': 'Dilute with RO water or fresh reservoir change',
+            'amount': '0.5-1 gallon RO water if <10% over target',
+            'reason': f'EC above target ({ec:.2f} > {tower_info["ec_range"][1]})',
+            'priority': 'high' if ec_far_over else 'medium',
+            'source': 'local'
+        }
+    
+    # pH adjustments
+    elif 'ph_high' in issue_type:
+        return {
+            'action': 'Add pH Down',
+            'amount': '0.5ml, wait 30min, retest',
+            'reason': f'pH above target ({ph:.2f} > {tower_info["ph_range"][1]})',
+            'priority': 'high',
+            'source': 'local'
+        }
+    
+    elif 'ph_low' in issue_type:
+        return {
+            'action': 'Check calibration - pH rarely drifts low',
+            'amount': 'N/A',
+            'reason': f'Unusual low pH ({ph:.2f}). Verify probe accuracy.',
+            'priority': 'high',
+            'source': 'local'
+        }
+    
+    # Calcium deficiency (tip burn)
+    elif 'calcium' in issue_type or 'tip_burn' in issue_type:
+        return {
+            'action': 'Foliar Ca spray + check air flow',
+            'amount': '5ml CalMagic per liter water, spray leaves',
+            'reason': 'Tip burn indicates Ca transport issue. Increase air circulation.',
+            'priority': 'high',
+            'source': 'local'
+        }
+    
+    # Nitrogen deficiency
+    elif 'nitrogen' in issue_type or 'yellowing' in issue_type:
+        if tower == 'cool':
+            return {
+                'action': 'Add Lettuce Fertilizer',
+                'amount': '5g',
+                'reason': 'Yellowing indicates nitrogen deficiency',
+                'priority': 'medium',
+                'source': 'local'
+            }
+        else:
+            return {
+                'action': 'Add MaxiGrow',
+                'amount': 'Small scoop (~5g)',
+                'reason': 'Yellowing indicates nitrogen deficiency',
+                'priority': 'medium',
+                'source': 'local'
+            }
+    
+    # Magnesium deficiency
+    elif 'magnesium' in issue_type:
+        return {
+            'action': 'Add Epsom Salt',
+            'amount': '2-3g',
+            'reason': 'Interveinal chlorosis suggests Mg deficiency',
+            'priority': 'medium',
+            'source': 'local'
+        }
+    
+    # Default
+    else:
+        return {
+            'action': 'Monitor and verify issue',
+            'amount': 'N/A',
+            'reason': f'Unknown issue type: {issue_type}',
+            'priority': 'low',
+            'source': 'local'
+        }
+
 
 class NutrientAdvisor:
     def __init__(self):
@@ -25,30 +213,18 @@ class NutrientAdvisor:
         self.xai_api_url = os.getenv('XAI_API_URL', 'https://api.x.ai/v1/chat/completions')
         self.xai_enabled = bool(self.xai_api_key)
         
+        # Keep-alive session: later queries skip the TCP/TLS handshake.
+        # Retries cover connection failures only (POST isn't retried once sent).
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(max_retries=Retry(total=2, backoff_factor=0.5)))
+        
         if self.xai_enabled:
             logger.info("xAI Grok API enabled for advanced recommendations")
         else:
             logger.warning("xAI Grok API not configured - using rule-based recommendations only")
         
         # Local nutrient knowledge base
-        self.nutrient_database = {
-            'cool': {
-                'base': 'Lettuce Fertilizer 8-15-36',
-                'buffer': 'CalMagic + Calcium Nitrate',
-                'supplements': ['Epsom Salt', 'Armor Si', 'Hydroguard'],
-                'ec_range': (1.2, 1.8),
-                'ph_range': (5.8, 6.2),
-                'plant_type': 'lettuce/dill'
-            },
-            'warm': {
-                'base': 'MaxiGrow 10-5-14',
-                'buffer': 'CalMagic',
-                'supplements': ['Armor Si', 'Epsom Salt', 'Hydroguard'],
-                'ec_range': (1.5, 2.0),
-                'ph_range': (5.8, 6.2),
-                'plant_type': 'basil/oregano'
-            }
-        }
+        self.nutrient_database = NUTRIENT_DATABASE
     
     def get_recommendation(self, tower: str, issue_type: str, 
                           sensor_data: Dict, deficiencies: List[str] = None) -> Dict:
@@ -80,35 +256,24 @@ class NutrientAdvisor:
             # Build context
             tower_info = self.nutrient_database[tower]
             
-            prompt = f"""You are an expert hydroponic nutrient advisor. Analyze this situation and provide a specific, actionable recommendation.
-
-Tower: {tower.capitalize()} ({tower_info['plant_type']})
-Issue: {issue_type}
-Deficiencies detected: {', '.join(deficiencies)}
-
-Current Sensor Data:
-- EC: {sensor_data.get('ec', 'N/A')} mS/cm (target: {tower_info['ec_range'][0]}-{tower_info['ec_range'][1]})
-- pH: {sensor_data.get('ph', 'N/A')} (target: {tower_info['ph_range'][0]}-{tower_info['ph_range'][1]})
-- Water Temp: {sensor_data.get('water_temp', 'N/A')}°F
-- Air Temp: {sensor_data.get('air_temp', 'N/A')}°F
-- Humidity: {sensor_data.get('humidity', 'N/A')}%
-
-Available Nutrients:
-- Base: {tower_info['base']}
-- Buffer: {tower_info['buffer']}
-- Supplements: {', '.join(tower_info['supplements'])}
-- pH Down, CalMagic, Epsom Salt, Calcium Nitrate
-
-Provide recommendation in JSON format:
-{{
-    "action": "specific nutrient to add",
-    "amount": "precise amount in grams or ml",
-    "reason": "explanation based on data",
-    "priority": "low/medium/high",
-    "additional_notes": "any other relevant advice"
-}}
-
-Be specific with amounts. Consider nutrient interactions and lockouts."""
+            prompt = GROK_PROMPT_TEMPLATE.format_map({
+                'tower': tower.capitalize(),
+                'plant_type': tower_info['plant_type'],
+                'issue_type': issue_type,
+                'deficiencies': ', '.join(deficiencies),
+                'ec': sensor_data.get('ec', 'N/A'),
+                'ec_min': tower_info['ec_range'][0],
+                'ec_max': tower_info['ec_range'][1],
+                'ph': sensor_data.get('ph', 'N/A'),
+                'ph_min': tower_info['ph_range'][0],
+                'ph_max': tower_info['ph_range'][1],
+                'water_temp': sensor_data.get('water_temp', 'N/A'),
+                'air_temp': sensor_data.get('air_temp', 'N/A'),
+                'humidity': sensor_data.get('humidity', 'N/A'),
+                'base': tower_info['base'],
+                'buffer': tower_info['buffer'],
+                'supplements': ', '.join(tower_info['supplements'])
+            })
 
             headers = {
                 'Authorization': f'Bearer {self.xai_api_key}',
@@ -128,10 +293,10 @@ Be specific with amounts. Consider nutrient interactions and lockouts."""
                     }
                 ],
                 'temperature': 0.3,  # Lower for more consistent recommendations
-                'max_tokens': 500
+                'max_tokens': GROK_MAX_TOKENS
             }
             
-            response = requests.post(
+            response = self._session.post(
                 self.xai_api_url,
                 headers=headers,
                 json=payload,
@@ -145,12 +310,10 @@ Be specific with amounts. Consider nutrient interactions and lockouts."""
                 # Try to parse JSON from response
                 try:
                     # Extract JSON from markdown code blocks if present
-                    if '```json' in content:
-                        content = content.split('```json')[1].split('```')[0].strip()
-                    elif '```' in content:
-                        content = content.split('```')[1].split('```')[0].strip()
+                    match = JSON_BLOCK.search(content)
+                    json_text = (match.group(1) or match.group(2)) if match else content
                     
-                    recommendation = json.loads(content)
+                    recommendation = json.loads(json_text)
                     recommendation['source'] = 'grok_ai'
                     
                     logger.info(f"Grok AI recommendation: {recommendation['action']}")
@@ -178,127 +341,27 @@ Be specific with amounts. Consider nutrient interactions and lockouts."""
     
     def _local_recommendation(self, tower: str, issue_type: str, sensor_data: Dict) -> Dict:
         """Local rule-based nutrient recommendations"""
-        tower_info = self.nutrient_database[tower]
         ec = sensor_data.get('ec', 0)
         ph = sensor_data.get('ph', 0)
         
-        # EC adjustments
-        if 'ec_low' in issue_type:
-            if tower == 'cool':
-                return {
-                    'action': 'Add Lettuce Fertilizer 8-15-36',
-                    'amount': '5-8g',
-                    'reason': f'EC below target ({ec:.2f} < {tower_info["ec_range"][0]})',
-                    'priority': 'medium',
-                    'source': 'local'
-                }
-            else:  # warm
-                return {
-                    'action': 'Add MaxiGrow (small scoop)',
-                    'amount': '~5g',
-                    'reason': f'EC below target ({ec:.2f} < {tower_info["ec_range"][0]})',
-                    'priority': 'medium',
-                    'source': 'local'
-                }
-        
-        elif 'ec_high' in issue_type:
-            return {
-                'action': 'Dilute with RO water or fresh reservoir change',
-                'amount': '0.5-1 gallon RO water if <10% over target',
-                'reason': f'EC above target ({ec:.2f} > {tower_info["ec_range"][1]})',
-                'priority': 'high' if ec > tower_info["ec_range"][1] * 1.2 else 'medium',
-                'source': 'local'
-            }
-        
-        # pH adjustments
-        elif 'ph_high' in issue_type:
-            return {
-                'action': 'Add pH Down',
-                'amount': '0.5ml, wait 30min, retest',
-                'reason': f'pH above target ({ph:.2f} > {tower_info["ph_range"][1]})',
-                'priority': 'high',
-                'source': 'local'
-            }
-        
-        elif 'ph_low' in issue_type:
-            return {
-                'action': 'Check calibration - pH rarely drifts low',
-                'amount': 'N/A',
-                'reason': f'Unusual low pH ({ph:.2f}). Verify probe accuracy.',
-                'priority': 'high',
-                'source': 'local'
-            }
+        # Readings only show to 2 decimals, so round them for the cache key;
+        # the one raw-value threshold is decided here and passed in
+        ec_far_over = ec is not None and ec > self.nutrient_database[tower]["ec_range"][1] * 1.2
+        if ec is not None:
+            ec = round(ec, 2)
+        if ph is not None:
+            ph = round(ph, 2)
+        recommendation = _local_recommendation_cached(tower, issue_type, ec, ph, ec_far_over)
         
-        # Calcium deficiency (tip burn)
-        elif 'calcium' in issue_type or 'tip_burn' in issue_type:
-            return {
-                'action': 'Foliar Ca spray + check air flow',
-                'amount': '5ml CalMagic per liter water, spray leaves',
-                'reason': 'Tip burn indicates Ca transport issue. Increase air circulation.',
-                'priority': 'high',
-                'source': 'local'
-            }
-        
-        # Nitrogen deficiency
-        elif 'nitrogen' in issue_type or 'yellowing' in issue_type:
-            if tower == 'cool':
-                return {
-                    'action': 'Add Lettuce Fertilizer',
-                    'amount': '5g',
-                    'reason': 'Yellowing indicates nitrogen deficiency',
-                    'priority': 'medium',
-                    'source': 'local'
-                }
-            else:
-                return {
-                    'action': 'Add MaxiGrow',
-                    'amount': 'Small scoop (~5g)',
-                    'reason': 'Yellowing indicates nitrogen deficiency',
-                    'priority': 'medium',
-                    'source': 'local'
-                }
-        
-        # Magnesium deficiency
-        elif 'magnesium' in issue_type:
-            return {
-                'action': 'Add Epsom Salt',
-                'amount': '2-3g',
-                'reason': 'Interveinal chlorosis suggests Mg deficiency',
-                'priority': 'medium',
-                'source': 'local'
-            }
-        
-        # Default
-        else:
-            return {
-                'action': 'Monitor and verify issue',
-                'amount': 'N/A',
-                'reason': f'Unknown issue type: {issue_type}',
-                'priority': 'low',
-                'source': 'local'
-            }
+        # Copy, so a caller editing its result can't alter the cached one
+        return dict(recommendation)
     
     def get_fresh_reservoir_recipe(self, tower: str) -> str:
         """Get full recipe for fresh reservoir mix"""
         if tower == 'cool':
-            return """Cool Tower Fresh Reservoir (5 gallons):
-1. Buffer: 5ml CalMagic + 10g Calcium Nitrate
-2. Fertilizer: 10-12g Lettuce Fertilizer 8-15-36
-3. Supplements: 5g Epsom Salt, 5ml Armor Si
-4. Mix order: Add buffers first, stir, then fertilizer/Epsom
-5. Aerate with air stones, adjust pH to 5.8-6.2
-6. Target EC: 1.2-1.8 mS/cm
-7. Wait 60min, then add 10ml Hydroguard"""
+            return FRESH_RESERVOIR_RECIPES['cool']
         else:  # warm
-            return """Warm Tower Fresh Reservoir (5 gallons):
-1. Buffer: 5ml CalMagic
-2. Fertilizer: 10g MaxiGrow (1 big + 1 little scoop)
-3. Supplements: 5ml Armor Si, optional 1-2g Epsom Salt
-4. Stir gently, aerate with air stones
-5. Adjust pH to 5.8-6.2
-6. Target EC: 1.5-2.0 mS/cm
-7. Wait 60min, then add 10ml Hydroguard"""
-
+            return FRESH_RESERVOIR_RECIPES['warm']
 
 if __name__ == '__main__':
     # Test mode
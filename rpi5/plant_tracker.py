@@ -14,15 +14,19 @@ Features:
 - Plant passport (digital record)
 """
 
-import json
 import os
 import sqlite3
+import threading
+from functools import lru_cache
+from collections import Counter
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import logging
-import paho.mqtt.client as mqtt
+import orjson
 from dotenv import load_dotenv
 
+from mqtt_singleton import add_connect_handler, get_client
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -31,8 +35,22 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# AI observations are written in batches: one transaction per this many,
+# or after this many seconds, whichever comes first
+OBSERVATION_BATCH_SIZE = 32
+OBSERVATION_FLUSH_SECONDS = 0.1
+
+# Retained plant status is published this long after the first change, with
+# only the latest state of each plant changed in the meantime
+STATUS_COALESCE_SECONDS = 0.1
+
+@lru_cache(maxsize=512)
+def _parse_iso(value: str) -> datetime:
+    """datetime.fromisoformat, cached: the same planted/harvest dates are parsed on every call"""
+    return datetime.fromisoformat(value)
+
 class PlantTracker:
-    def __init__(self, db_path="/home/pi/hydro_data/plants.db"):
+    def __init__(self, db_path="/home/pi/hydro_data/plants.db", client=None):
         self.db_path = db_path
         self.max_plants_per_tower = int(os.getenv("MAX_PLANTS_PER_TOWER", 30))
         
@@ -77,11 +95,24 @@ class PlantTracker:
         # Initialize database
         self._init_database()
         
-        # MQTT client
-        self.client = mqtt.Client()
-        self.client.username_pw_set(self.username, self.password)
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
+        # AI observations waiting for the next batched write
+        self._pending_observations = []
+        self._flush_timer = None
+        
+        # plant_id -> None, in queue order, for the next status publish
+        self._pending_status = {}
+        self._status_timer = None
+        
+        # Active plants per tower and variety (see _active_variety_counts)
+        self._active_counts = None
+        self._active_counts_version = None
+        
+        # MQTT client, shared with any other service in this process
+        # (e.g. PlantingScheduler)
+        self.client = client or get_client()
+        add_connect_handler(self.client, self.on_connect)
+        self.client.message_callback_add("/plants/+/command", self.on_message)
+        self.client.message_callback_add("/ai/plant_identified", self.on_message)
         
         logger.info("Plant Tracker initialized")
     
@@ -89,8 +120,20 @@ class PlantTracker:
         """Initialize SQLite database for plant tracking"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # One long-lived connection, shared with the MQTT network thread.
+        # Reentrant lock: plant_seed holds it across its capacity check.
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        
+        cursor = self.conn.cursor()
+        
+        # WAL: PlantingScheduler's reads and our writes don't block each other,
+        # and with synchronous=NORMAL a commit doesn't fsync the SD card
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
         
         # Plants table
         cursor.execute('''
@@ -144,8 +187,36 @@ class PlantTracker:
             )
         ''')
         
-        conn.commit()
-        conn.close()
+        # Active plants only (harvest_date IS NULL): every count, section and
+        # schedule query filters on it; the variety column lets GROUP BY
+        # variety read in index order with no sort
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_plants_active
+            ON plants(tower, variety) WHERE harvest_date IS NULL
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_observations_plant
+            ON observations(plant_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_harvests_plant
+            ON harvests(plant_id)
+        ''')
+        
+        # Refresh planner statistics so the indexes above are chosen
+        cursor.execute("ANALYZE")
+        
+        # Days to harvest per variety, so harvest dates can be filtered in SQL.
+        # Per connection, seeded from self.growth_stages.
+        cursor.execute('''
+            CREATE TEMP TABLE growth_cycles (
+                variety TEXT PRIMARY KEY,
+                harvest_days INTEGER NOT NULL
+            )
+        ''')
+        cursor.executemany('INSERT INTO growth_cycles VALUES (?, ?)',
+                           [(variety, stages["harvest"]) for variety, stages in self.growth_stages.items()])
+        
         logger.info(f"Database initialized at {self.db_path}")
     
     def generate_plant_id(self, tower: str, section: int, position: str) -> str:
@@ -164,53 +235,114 @@ class PlantTracker:
         """Register a new plant"""
         plant_id = self.generate_plant_id(tower, section, position)
         
-        # Check tower capacity
-        current_count = self.get_active_plant_count(tower)
-        if current_count >= self.max_plants_per_tower:
-            raise ValueError(f"{tower.upper()} tower at capacity ({self.max_plants_per_tower} plants)")
+        with self._lock:
+            # Check tower capacity
+            current_count = self.get_active_plant_count(tower)
+            if current_count >= self.max_plants_per_tower:
+                raise ValueError(f"{tower.upper()} tower at capacity ({self.max_plants_per_tower} plants)")
+            
+            try:
+                self.conn.execute('''
+                    INSERT INTO plants (plant_id, tower, section, position, variety, planted_date, notes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (plant_id, tower, section, position, variety, datetime.now().isoformat(), notes))
+                self._active_counts = None
+            except sqlite3.IntegrityError:
+                logger.error(f"Plant ID {plant_id} already exists")
+                raise ValueError(f"Plant ID {plant_id} already exists")
+        
+        # Publish to MQTT
+        self.publish_plant_status(plant_id)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        logger.info(f"New plant registered: {plant_id} ({variety})")
         
-        try:
-            cursor.execute('''
-                INSERT INTO plants (plant_id, tower, section, position, variety, planted_date, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (plant_id, tower, section, position, variety, datetime.now().isoformat(), notes))
-            
-            conn.commit()
-            
-            # Publish to MQTT
-            self.publish_plant_status(plant_id)
-            
-            logger.info(f"New plant registered: {plant_id} ({variety})")
-            
-            return {
-                "plant_id": plant_id,
-                "variety": variety,
-                "planted_date": datetime.now().isoformat(),
-                "estimated_harvest": self.estimate_harvest_date(variety, datetime.now())
-            }
+        return {
+            "plant_id": plant_id,
+            "variety": variety,
+            "planted_date": datetime.now().isoformat(),
+            "estimated_harvest": self.estimate_harvest_date(variety, datetime.now())
+        }
+    
+    def plant_seed_bulk(self, plants: List[Tuple]) -> List[Dict]:
+        """
+        Register several plants in one transaction
         
-        except sqlite3.IntegrityError:
-            logger.error(f"Plant ID {plant_id} already exists")
-            raise ValueError(f"Plant ID {plant_id} already exists")
-        finally:
-            conn.close()
+        Args:
+            plants: (tower, section, position, variety[, notes]) per plant,
+                    as for plant_seed(); the batch is rejected as a whole
+        """
+        now = datetime.now()
+        planted_date = now.isoformat()
+        
+        rows = []
+        new_per_tower = Counter()
+        for tower, section, position, variety, *notes in plants:
+            plant_id = self.generate_plant_id(tower, section, position)
+            rows.append((plant_id, tower, section, position, variety, planted_date,
+                         notes[0] if notes else ""))
+            new_per_tower[tower] += 1
+        
+        with self._lock:
+            # Check tower capacity for the whole batch
+            for tower, new_count in new_per_tower.items():
+                if self.get_active_plant_count(tower) + new_count > self.max_plants_per_tower:
+                    raise ValueError(f"{tower.upper()} tower at capacity ({self.max_plants_per_tower} plants)")
+            
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                cursor.executemany('''
+                    INSERT INTO plants (plant_id, tower, section, position, variety, planted_date, notes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                cursor.execute("COMMIT")
+                self._active_counts = None
+            except sqlite3.IntegrityError as e:
+                cursor.execute("ROLLBACK")
+                logger.error(f"Plant batch rejected: {e}")
+                raise ValueError(f"Plant batch rejected: {e}")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        
+        # Publish to MQTT
+        for row in rows:
+            self.publish_plant_status(row[0])
+        
+        logger.info(f"{len(rows)} new plants registered")
+        
+        return [{
+            "plant_id": row[0],
+            "variety": row[4],
+            "planted_date": planted_date,
+            "estimated_harvest": self.estimate_harvest_date(row[4], now)
+        } for row in rows]
     
     def get_active_plant_count(self, tower: str) -> int:
         """Get count of active (not harvested) plants in tower"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM plants 
-            WHERE tower = ? AND harvest_date IS NULL
-        ''', (tower,))
+        return sum(self._active_variety_counts(tower).values())
+    
+    def _active_variety_counts(self, tower: str) -> Counter:
+        """
+        Active plants per variety in tower
         
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        All towers are counted in one scan and cached. Our own writes clear
+        the cache; PRAGMA data_version changes when another connection
+        (e.g. PlantingScheduler) commits.
+        """
+        with self._lock:
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._active_counts is None or data_version != self._active_counts_version:
+                self._active_counts = {}
+                for plant_tower, variety, count in self.conn.execute('''
+                    SELECT tower, variety, COUNT(*) FROM plants
+                    WHERE harvest_date IS NULL
+                    GROUP BY tower, variety
+                '''):
+                    self._active_counts.setdefault(plant_tower, Counter())[variety] = count
+                self._active_counts_version = data_version
+            
+            return self._active_counts.get(tower, Counter())
     
     def estimate_harvest_date(self, variety: str, planted_date: datetime) -> str:
         """Estimate harvest date based on variety"""
@@ -223,24 +355,20 @@ class PlantTracker:
     
     def update_stage(self, plant_id: str, new_stage: str, notes: str = ""):
         """Update plant growth stage"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        if new_stage == "germinated":
-            cursor.execute('''
-                UPDATE plants 
-                SET current_stage = 'seedling', germination_date = ?, notes = ?, updated_at = ?
-                WHERE plant_id = ?
-            ''', (datetime.now().isoformat(), notes, datetime.now().isoformat(), plant_id))
-        else:
-            cursor.execute('''
-                UPDATE plants 
-                SET current_stage = ?, notes = ?, updated_at = ?
-                WHERE plant_id = ?
-            ''', (new_stage, notes, datetime.now().isoformat(), plant_id))
-        
-        conn.commit()
-        conn.close()
+        with self._lock:
+            cursor = self.conn.cursor()
+            if new_stage == "germinated":
+                cursor.execute('''
+                    UPDATE plants 
+                    SET current_stage = 'seedling', germination_date = ?, notes = ?, updated_at = ?
+                    WHERE plant_id = ?
+                ''', (datetime.now().isoformat(), notes, datetime.now().isoformat(), plant_id))
+            else:
+                cursor.execute('''
+                    UPDATE plants 
+                    SET current_stage = ?, notes = ?, updated_at = ?
+                    WHERE plant_id = ?
+                ''', (new_stage, notes, datetime.now().isoformat(), plant_id))
         
         self.publish_plant_status(plant_id)
         logger.info(f"{plant_id} stage updated to {new_stage}")
@@ -250,65 +378,132 @@ class PlantTracker:
                        deficiencies: str = "", image_path: str = "", notes: str = "",
                        ai_confidence: float = 0.0):
         """Add growth observation"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get current stage
-        cursor.execute('SELECT current_stage FROM plants WHERE plant_id = ?', (plant_id,))
-        result = cursor.fetchone()
-        if not result:
-            logger.error(f"Plant {plant_id} not found")
-            return
-        
-        stage = result[0]
-        
-        cursor.execute('''
-            INSERT INTO observations 
-            (plant_id, observation_date, stage, height_cm, leaf_count, health_score, 
-             deficiencies, image_path, notes, ai_confidence)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (plant_id, datetime.now().isoformat(), stage, height_cm, leaf_count,
-              health_score, deficiencies, image_path, notes, ai_confidence))
-        
-        conn.commit()
-        conn.close()
+        with self._lock:
+            cursor = self.conn.cursor()
+            
+            # Get current stage
+            cursor.execute('SELECT current_stage FROM plants WHERE plant_id = ?', (plant_id,))
+            result = cursor.fetchone()
+            if not result:
+                logger.error(f"Plant {plant_id} not found")
+                return
+            
+            stage = result["current_stage"]
+            
+            cursor.execute('''
+                INSERT INTO observations 
+                (plant_id, observation_date, stage, height_cm, leaf_count, health_score, 
+                 deficiencies, image_path, notes, ai_confidence)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (plant_id, datetime.now().isoformat(), stage, height_cm, leaf_count,
+                  health_score, deficiencies, image_path, notes, ai_confidence))
         
         logger.info(f"Observation added for {plant_id}")
     
+    def add_observation_bulk(self, observations: List[Dict]):
+        """
+        Add several observations in one transaction
+        
+        Args:
+            observations: plant_id plus add_observation() keyword arguments,
+                          per observation; unknown plants are skipped
+        """
+        observation_date = datetime.now().isoformat()
+        rows = [(observation_date, obs.get("height_cm"), obs.get("leaf_count"),
+                 obs.get("health_score"), obs.get("deficiencies", ""), obs.get("image_path", ""),
+                 obs.get("notes", ""), obs.get("ai_confidence", 0.0), obs.get("plant_id"))
+                for obs in observations]
+        
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                # Stage is taken from the plant row, so a missing plant inserts nothing
+                cursor.executemany('''
+                    INSERT INTO observations 
+                    (plant_id, observation_date, stage, height_cm, leaf_count, health_score, 
+                     deficiencies, image_path, notes, ai_confidence)
+                    SELECT plant_id, ?, current_stage, ?, ?, ?, ?, ?, ?, ?
+                    FROM plants WHERE plant_id = ?
+                ''', rows)
+                added = cursor.rowcount
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        
+        if added < len(rows):
+            logger.error(f"{len(rows) - added} observations skipped: plant not found")
+        logger.info(f"{added} observations added")
+    
+    def _queue_observation(self, observation: Dict):
+        """Queue an observation; written with the next batch"""
+        with self._lock:
+            self._pending_observations.append(observation)
+            flush_now = len(self._pending_observations) >= OBSERVATION_BATCH_SIZE
+            if not flush_now and self._flush_timer is None:
+                self._flush_timer = threading.Timer(OBSERVATION_FLUSH_SECONDS, self.flush_observations)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        
+        if flush_now:
+            self.flush_observations()
+    
+    def flush_observations(self):
+        """Write all queued observations in one transaction"""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            observations, self._pending_observations = self._pending_observations, []
+            if not observations:
+                return
+            
+            try:
+                self.add_observation_bulk(observations)
+            except Exception as e:
+                logger.error(f"Failed to store {len(observations)} observations: {e}")
+    
     def record_harvest(self, plant_id: str, weight_grams: float, quality_score: int,
                       image_path: str = "", notes: str = ""):
         """Record plant harvest"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get planted date
-        cursor.execute('SELECT planted_date FROM plants WHERE plant_id = ?', (plant_id,))
-        result = cursor.fetchone()
-        if not result:
-            logger.error(f"Plant {plant_id} not found")
-            return
-        
-        planted_date = datetime.fromisoformat(result[0])
-        harvest_date = datetime.now()
-        days_to_harvest = (harvest_date - planted_date).days
-        
-        # Update plant record
-        cursor.execute('''
-            UPDATE plants 
-            SET harvest_date = ?, current_stage = 'harvested', updated_at = ?
-            WHERE plant_id = ?
-        ''', (harvest_date.isoformat(), harvest_date.isoformat(), plant_id))
-        
-        # Insert harvest record
-        cursor.execute('''
-            INSERT INTO harvests 
-            (plant_id, harvest_date, weight_grams, quality_score, days_to_harvest, image_path, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (plant_id, harvest_date.isoformat(), weight_grams, quality_score,
-              days_to_harvest, image_path, notes))
-        
-        conn.commit()
-        conn.close()
+        with self._lock:
+            cursor = self.conn.cursor()
+            
+            # Get planted date
+            cursor.execute('SELECT planted_date FROM plants WHERE plant_id = ?', (plant_id,))
+            result = cursor.fetchone()
+            if not result:
+                logger.error(f"Plant {plant_id} not found")
+                return
+            
+            planted_date = _parse_iso(result["planted_date"])
+            harvest_date = datetime.now()
+            days_to_harvest = (harvest_date - planted_date).days
+            
+            # Plant update and harvest record land together
+            cursor.execute("BEGIN")
+            try:
+                # Update plant record
+                cursor.execute('''
+                    UPDATE plants 
+                    SET harvest_date = ?, current_stage = 'harvested', updated_at = ?
+                    WHERE plant_id = ?
+                ''', (harvest_date.isoformat(), harvest_date.isoformat(), plant_id))
+                
+                # Insert harvest record
+                cursor.execute('''
+                    INSERT INTO harvests 
+                    (plant_id, harvest_date, weight_grams, quality_score, days_to_harvest, image_path, notes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (plant_id, harvest_date.isoformat(), weight_grams, quality_score,
+                      days_to_harvest, image_path, notes))
+                
+                cursor.execute("COMMIT")
+                self._active_counts = None
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
         
         # Publish harvest event
         harvest_data = {
@@ -319,67 +514,80 @@ class PlantTracker:
             "days_to_harvest": days_to_harvest
         }
         
-        self.client.publish("/events/harvest", json.dumps(harvest_data))
+        self.client.publish("/events/harvest", orjson.dumps(harvest_data), qos=0)
         
         logger.info(f"Harvest recorded for {plant_id}: {weight_grams}g in {days_to_harvest} days")
     
     def publish_plant_status(self, plant_id: str):
+        """Queue plant status for MQTT; a burst of changes publishes once"""
+        with self._lock:
+            self._pending_status[plant_id] = None
+            if self._status_timer is None:
+                self._status_timer = threading.Timer(STATUS_COALESCE_SECONDS, self.flush_plant_status)
+                self._status_timer.daemon = True
+                self._status_timer.start()
+    
+    def flush_plant_status(self):
+        """Publish the current status of every queued plant"""
+        with self._lock:
+            if self._status_timer is not None:
+                self._status_timer.cancel()
+                self._status_timer = None
+            plant_ids, self._pending_status = list(self._pending_status), {}
+        
+        for plant_id in plant_ids:
+            self._publish_status(plant_id)
+    
+    def _publish_status(self, plant_id: str):
         """Publish plant status to MQTT"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM plants WHERE plant_id = ?', (plant_id,))
-        result = cursor.fetchone()
-        conn.close()
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT plant_id, tower, variety, planted_date, current_stage, health_status
+                FROM plants WHERE plant_id = ?
+            ''', (plant_id,))
+            result = cursor.fetchone()
         
         if not result:
             return
         
-        status = {
-            "plant_id": result[0],
-            "tower": result[1],
-            "variety": result[4],
-            "planted_date": result[5],
-            "current_stage": result[8],
-            "health_status": result[9],
-            "days_since_planting": (datetime.now() - datetime.fromisoformat(result[5])).days
-        }
+        status = dict(result)
+        status["days_since_planting"] = (datetime.now() - _parse_iso(result["planted_date"])).days
         
-        self.client.publish(f"/plants/{plant_id}", json.dumps(status), retain=True)
+        # Idempotent, retained state: QoS 0 is enough
+        self.client.publish(f"/plants/{plant_id}", orjson.dumps(status), qos=0, retain=True)
     
     def get_harvest_calendar(self, days_ahead: int = 14) -> List[Dict]:
         """Get upcoming harvests"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT plant_id, variety, planted_date, current_stage
-            FROM plants
-            WHERE harvest_date IS NULL
-        ''')
+        with self._lock:
+            cursor = self.conn.cursor()
+            
+            # planted_date is naive local time, so 'now' is too; days_until is
+            # fractional here and whole days below
+            cursor.execute('''
+                SELECT p.plant_id, p.variety, p.planted_date, p.current_stage, c.harvest_days,
+                       julianday(p.planted_date) + c.harvest_days
+                           - julianday('now', 'localtime') AS days_until
+                FROM plants p
+                JOIN growth_cycles c ON c.variety = lower(p.variety)
+                WHERE p.harvest_date IS NULL
+                AND days_until >= 0 AND days_until < ? + 1
+                ORDER BY days_until
+            ''', (days_ahead,))
+            rows = cursor.fetchall()
         
         upcoming = []
-        now = datetime.now()
-        
-        for row in cursor.fetchall():
-            plant_id, variety, planted_date, stage = row
-            planted = datetime.fromisoformat(planted_date)
-            
-            if variety.lower() in self.growth_stages:
-                est_harvest = planted + timedelta(days=self.growth_stages[variety.lower()]["harvest"])
-                days_until = (est_harvest - now).days
-                
-                if 0 <= days_until <= days_ahead:
-                    upcoming.append({
-                        "plant_id": plant_id,
-                        "variety": variety,
-                        "estimated_harvest": est_harvest.isoformat(),
-                        "days_until": days_until,
-                        "current_stage": stage
-                    })
+        for plant_id, variety, planted_date, stage, harvest_days, days_until in rows:
+            est_harvest = _parse_iso(planted_date) + timedelta(days=harvest_days)
+            upcoming.append({
+                "plant_id": plant_id,
+                "variety": variety,
+                "estimated_harvest": est_harvest.isoformat(),
+                "days_until": int(days_until),
+                "current_stage": stage
+            })
         
-        conn.close()
-        return sorted(upcoming, key=lambda x: x["days_until"])
+        return upcoming
     
     def on_connect(self, client, userdata, flags, rc):
         """MQTT connection handler"""
@@ -394,7 +602,7 @@ class PlantTracker:
         """MQTT message handler"""
         try:
             topic = msg.topic
-            payload = json.loads(msg.payload.decode())
+            payload = orjson.loads(msg.payload)
             
             if "/command" in topic:
                 plant_id = topic.split('/')[2]
@@ -408,17 +616,15 @@ class PlantTracker:
                     self.record_harvest(plant_id, **payload.get("data", {}))
             
             elif topic == "/ai/plant_identified":
-                # AI has identified a plant from image
-                plant_id = payload.get("plant_id")
-                confidence = payload.get("confidence", 0.0)
-                deficiencies = payload.get("deficiencies", "")
-                
-                self.add_observation(
-                    plant_id,
-                    deficiencies=deficiencies,
-                    image_path=payload.get("image_path", ""),
-                    ai_confidence=confidence
-                )
+                # AI has identified a plant (or a list of them) from an image;
+                # bursts are written together (see _queue_observation)
+                for identified in (payload if isinstance(payload, list) else [payload]):
+                    self._queue_observation({
+                        "plant_id": identified.get("plant_id"),
+                        "deficiencies": identified.get("deficiencies", ""),
+                        "image_path": identified.get("image_path", ""),
+                        "ai_confidence": identified.get("confidence", 0.0)
+                    })
         
         except Exception as e:
             logger.error(f"Error processing message: {e}")
@@ -431,6 +637,8 @@ class PlantTracker:
             self.client.loop_forever()
         except KeyboardInterrupt:
             logger.info("Shutting down Plant Tracker...")
+            self.flush_observations()
+            self.flush_plant_status()
             self.client.disconnect()
         except Exception as e:
             logger.error(f"Fatal error: {e}")
@@ -12,14 +12,20 @@ Features:
 """
 
 import os
-import json
 import logging
 import sqlite3
+import threading
+import time
+from functools import lru_cache
+from collections import Counter
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
+import orjson
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 
+from mqtt_singleton import get_client
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -28,8 +34,13 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+@lru_cache(maxsize=512)
+def _parse_iso(value: str) -> datetime:
+    """Cached datetime.fromisoformat; each schedule re-reads the same plant dates"""
+    return datetime.fromisoformat(value)
+
 class PlantingScheduler:
-    def __init__(self, db_path="/home/pi/hydro_data/plants.db"):
+    def __init__(self, db_path="/home/pi/hydro_data/plants.db", client=None):
         self.db_path = db_path
         self.max_plants = int(os.getenv("MAX_PLANTS_PER_TOWER", 30))
         
@@ -49,31 +60,55 @@ class PlantingScheduler:
             "oregano": 14
         }
         
+        # One long-lived connection to the plant tracker's database
+        # (WAL mode is set by PlantTracker and persists in the file)
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self._lock = threading.Lock()
+        
+        # Days to harvest per variety, so harvest dates can be filtered in SQL.
+        # Per connection, seeded from self.growth_cycles.
+        self.conn.execute('''
+            CREATE TEMP TABLE growth_cycles (
+                variety TEXT PRIMARY KEY,
+                harvest_days INTEGER NOT NULL
+            )
+        ''')
+        self.conn.executemany('INSERT INTO growth_cycles VALUES (?, ?)', self.growth_cycles.items())
+        
+        # Active plants per tower and variety (see _active_variety_counts)
+        self._active_counts = None
+        self._active_counts_version = None
+        
         # MQTT Configuration
         self.broker = os.getenv("MQTT_BROKER", "10.0.0.62")
         self.port = int(os.getenv("MQTT_PORT", 1883))
         self.username = os.getenv("MQTT_USERNAME", "hydro_user")
         self.password = os.getenv("MQTT_PASSWORD", "")
         
-        # MQTT client
-        self.client = mqtt.Client()
-        self.client.username_pw_set(self.username, self.password)
+        # Republish interval for run(); 0 publishes once and exits
+        self.schedule_interval_hours = float(os.getenv("PLANTING_SCHEDULE_INTERVAL_HOURS", 0))
+        
+        # MQTT client, shared with any other service in this process
+        # (e.g. PlantTracker)
+        self.client = client or get_client()
+        self._last_publish = None
         
         logger.info("Planting Scheduler initialized")
     
     def get_available_sections(self, tower: str) -> List[int]:
         """Get available planting sections"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get occupied sections
-        cursor.execute('''
-            SELECT DISTINCT section FROM plants
-            WHERE tower = ? AND harvest_date IS NULL
-        ''', (tower,))
-        
-        occupied = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        with self._lock:
+            cursor = self.conn.cursor()
+            
+            # Get occupied sections
+            cursor.execute('''
+                SELECT DISTINCT section FROM plants
+                WHERE tower = ? AND harvest_date IS NULL
+            ''', (tower,))
+            
+            occupied = [row[0] for row in cursor.fetchall()]
         
         # Return unoccupied sections (1-15 available per tower)
         all_sections = list(range(1, 16))
@@ -83,51 +118,59 @@ class PlantingScheduler:
     
     def get_current_plant_count(self, tower: str) -> int:
         """Get current active plant count"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM plants
-            WHERE tower = ? AND harvest_date IS NULL
-        ''', (tower,))
+        return sum(self._active_variety_counts(tower).values())
+    
+    def _active_variety_counts(self, tower: str) -> Counter:
+        """
+        Active plants per variety in tower
         
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        All towers are counted in one scan and cached until PRAGMA
+        data_version shows PlantTracker has committed a change.
+        """
+        with self._lock:
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._active_counts is None or data_version != self._active_counts_version:
+                self._active_counts = {}
+                for plant_tower, variety, count in self.conn.execute('''
+                    SELECT tower, variety, COUNT(*) FROM plants
+                    WHERE harvest_date IS NULL
+                    GROUP BY tower, variety
+                '''):
+                    self._active_counts.setdefault(plant_tower, Counter())[variety] = count
+                self._active_counts_version = data_version
+            
+            return self._active_counts.get(tower, Counter())
     
     def get_upcoming_harvests(self, tower: str, days_ahead: int = 30) -> List[Dict]:
         """Get upcoming harvest dates"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT plant_id, variety, planted_date
-            FROM plants
-            WHERE tower = ? AND harvest_date IS NULL
-        ''', (tower,))
+        with self._lock:
+            cursor = self.conn.cursor()
+            
+            # planted_date is naive local time, so 'now' is too; days_until is
+            # fractional here and whole days below
+            cursor.execute('''
+                SELECT p.plant_id, p.variety, p.planted_date, c.harvest_days,
+                       julianday(p.planted_date) + c.harvest_days
+                           - julianday('now', 'localtime') AS days_until
+                FROM plants p
+                JOIN growth_cycles c ON c.variety = lower(p.variety)
+                WHERE p.tower = ? AND p.harvest_date IS NULL
+                AND days_until >= 0 AND days_until < ? + 1
+                ORDER BY days_until
+            ''', (tower, days_ahead))
+            rows = cursor.fetchall()
         
         harvests = []
-        now = datetime.now()
+        for plant_id, variety, planted_date, harvest_days, days_until in rows:
+            est_harvest = _parse_iso(planted_date) + timedelta(days=harvest_days)
+            harvests.append({
+                "plant_id": plant_id,
+                "variety": variety,
+                "harvest_date": est_harvest.isoformat(),
+                "days_until": int(days_until)
+            })
         
-        for row in cursor.fetchall():
-            plant_id, variety, planted_date = row
-            planted = datetime.fromisoformat(planted_date)
-            
-            if variety.lower() in self.growth_cycles:
-                harvest_days = self.growth_cycles[variety.lower()]
-                est_harvest = planted + timedelta(days=harvest_days)
-                days_until = (est_harvest - now).days
-                
-                if 0 <= days_until <= days_ahead:
-                    harvests.append({
-                        "plant_id": plant_id,
-                        "variety": variety,
-                        "harvest_date": est_harvest.isoformat(),
-                        "days_until": days_until
-                    })
-        
-        conn.close()
-        return sorted(harvests, key=lambda x: x["days_until"])
+        return harvests
     
     def calculate_planting_schedule(self, tower: str, target_plants: int = 25) -> List[Dict]:
         """
@@ -150,17 +193,27 @@ class PlantingScheduler:
             varieties = ["basil", "oregano"]
         
         schedule = []
+        now = datetime.now()
+        
+        # Harvest dates in order, parsed once; the day loop below advances a
+        # pointer through them instead of rescanning the list each day
+        harvest_dates = sorted(_parse_iso(harvest["harvest_date"])
+                               for harvest in upcoming_harvests)
+        harvested = 0
+        last_planting_day = None
         
         # Calculate planting needs based on harvest schedule
         for i in range(60):  # Look 60 days ahead
-            check_date = datetime.now() + timedelta(days=i)
+            check_date = now + timedelta(days=i)
             
             # Count plants that will still be growing on this date
-            active_on_date = current_count
-            for harvest in upcoming_harvests:
-                harvest_date = datetime.fromisoformat(harvest["harvest_date"])
-                if check_date >= harvest_date:
-                    active_on_date -= 1
+            while harvested < len(harvest_dates) and harvest_dates[harvested] <= check_date:
+                harvested += 1
+            active_on_date = current_count - harvested
+            
+            # Only schedule one planting per week
+            if last_planting_day is not None and i - last_planting_day < 7:
+                continue
             
             # If below target, schedule a planting
             if active_on_date < target_plants:
@@ -168,35 +221,23 @@ class PlantingScheduler:
                 # Alternate between varieties for diversity
                 variety_idx = len(schedule) % len(varieties)
                 variety = varieties[variety_idx]
+                growth_days = self.growth_cycles[variety]
                 
                 schedule.append({
-                    "date": check_date.isoformat(),
+                    "date": check_date.isoformat(timespec="seconds"),
                     "variety": variety,
                     "reason": f"Maintain target population ({active_on_date}/{target_plants})",
-                    "growth_days": self.growth_cycles[variety],
-                    "estimated_harvest": (check_date + timedelta(days=self.growth_cycles[variety])).isoformat()
+                    "growth_days": growth_days,
+                    "estimated_harvest": (check_date + timedelta(days=growth_days)).isoformat(timespec="seconds")
                 })
-                
-                # Only schedule one planting per week
-                i += 7
+                last_planting_day = i
         
         return schedule[:10]  # Return next 10 planting suggestions
     
     def get_ai_variety_recommendation(self, tower: str) -> str:
         """Get AI recommendation for which variety to plant next"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         # Get variety distribution in tower
-        cursor.execute('''
-            SELECT variety, COUNT(*) as count
-            FROM plants
-            WHERE tower = ? AND harvest_date IS NULL
-            GROUP BY variety
-        ''', (tower,))
-        
-        variety_counts = {row[0]: row[1] for row in cursor.fetchall()}
-        conn.close()
+        variety_counts = self._active_variety_counts(tower)
         
         # Recommend variety with lowest count
         if tower == "cool":
@@ -228,31 +269,55 @@ class PlantingScheduler:
             "current_count": self.get_current_plant_count(tower),
             "available_sections": len(self.get_available_sections(tower)),
             "upcoming_harvests": len(self.get_upcoming_harvests(tower)),
-            "generated_at": datetime.now().isoformat()
+            "generated_at": datetime.now().isoformat(timespec="seconds")
         }
         
-        self.client.publish(f"/{tower}/planting_schedule", json.dumps(data), retain=True)
+        self._last_publish = self.client.publish(f"/{tower}/planting_schedule", orjson.dumps(data),
+                                                 qos=0, retain=True)
         logger.info(f"Published planting schedule for {tower} tower")
         
         return data
     
+    def publish_schedules(self):
+        """Publish schedules for both towers"""
+        cool_schedule = self.publish_schedule("cool")
+        warm_schedule = self.publish_schedule("warm")
+        
+        logger.info(f"Cool tower: {len(cool_schedule['schedule'])} plantings recommended")
+        logger.info(f"Warm tower: {len(warm_schedule['schedule'])} plantings recommended")
+    
     def run(self):
-        """Generate and publish schedules"""
+        """
+        Generate and publish schedules
+        
+        With PLANTING_SCHEDULE_INTERVAL_HOURS set, stays connected and
+        republishes on that interval instead of exiting.
+        """
+        # A co-located service may already run the shared client's network
+        # loop; otherwise connect and run it here for the duration
+        owns_loop = not self.client.is_connected()
         try:
             logger.info("Generating planting schedules...")
-            self.client.connect(self.broker, self.port, 60)
-            
-            # Publish schedules for both towers
-            cool_schedule = self.publish_schedule("cool")
-            warm_schedule = self.publish_schedule("warm")
-            
-            logger.info(f"Cool tower: {len(cool_schedule['schedule'])} plantings recommended")
-            logger.info(f"Warm tower: {len(warm_schedule['schedule'])} plantings recommended")
+            if owns_loop:
+                self.client.connect(self.broker, self.port, 60)
+                self.client.loop_start()
             
-            self.client.disconnect()
+            self.publish_schedules()
+            while self.schedule_interval_hours > 0:
+                time.sleep(self.schedule_interval_hours * 3600)
+                self.publish_schedules()
         
+        except KeyboardInterrupt:
+            logger.info("Shutting down Planting Scheduler...")
         except Exception as e:
             logger.error(f"Error generating schedules: {e}")
+        finally:
+            if owns_loop:
+                # Let the retained schedules reach the broker before closing
+                if self._last_publish is not None and self._last_publish.rc == mqtt.MQTT_ERR_SUCCESS:
+                    self._last_publish.wait_for_publish(timeout=5)
+                self.client.disconnect()
+                self.client.loop_stop()
 
 def main():
     scheduler = PlantingScheduler()
@@ -83,6 +83,7 @@ class SensorMonitor:
             'warm': {'ec': None, 'ph': None, 'water_temp': None, 'last_update': None},
             'environment': {'air_temp': None, 'humidity': None, 'last_update': None}
         }
+        # last_update is a time.monotonic() reading, for staleness checks only
         
         # Issue tracking
         self.active_issues = {}
@@ -150,16 +151,16 @@ class SensorMonitor:
                 tower = 'cool'
                 sensor = topic.split('/')[-1]
                 self.sensor_data['cool'][sensor] = value
-                self.sensor_data['cool']['last_update'] = datetime.now()
+                self.sensor_data['cool']['last_update'] = time.monotonic()
             elif '/warm_tower/' in topic:
                 tower = 'warm'
                 sensor = topic.split('/')[-1]
                 self.sensor_data['warm'][sensor] = value
-                self.sensor_data['warm']['last_update'] = datetime.now()
+                self.sensor_data['warm']['last_update'] = time.monotonic()
             elif '/environment/' in topic:
                 sensor = topic.split('/')[-1]
                 self.sensor_data['environment'][sensor] = value
-                self.sensor_data['environment']['last_update'] = datetime.now()
+                self.sensor_data['environment']['last_update'] = time.monotonic()
             
             # Check thresholds
             if tower in ['cool', 'warm']:
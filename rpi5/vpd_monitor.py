@@ -15,6 +15,7 @@ import time
 import logging
 from datetime import datetime
 from typing import Dict, Optional, Tuple
+import numpy as np
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 import os
@@ -44,21 +45,26 @@ class VPDMonitor:
         # Tower-specific data
         self.tower_data = {
             "cool": {
-                "air_temp": None,
-                "air_humidity": None,
                 "vpd": None,
                 "ideal_range": (0.4, 0.8),  # kPa for lettuce/dill
                 "last_alert": 0
             },
             "warm": {
-                "air_temp": None,
-                "air_humidity": None,
                 "vpd": None,
                 "ideal_range": (0.8, 1.2),  # kPa for basil/oregano
                 "last_alert": 0
             }
         }
         
+        # Air readings, one slot per tower (NaN = no reading yet)
+        self._tidx = {tower: i for i, tower in enumerate(self.tower_data)}
+        self._air_temp = np.full(len(self._tidx), np.nan)  # Celsius
+        self._air_hum = np.full(len(self._tidx), np.nan)
+        
+        # Output topics per tower
+        self._vpd_topic = {tower: f"/{tower}/vpd" for tower in self._tidx}
+        self._status_topic = {tower: f"/{tower}/vpd_status" for tower in self._tidx}
+        
         # MQTT client setup
         self.client = mqtt.Client()
         self.client.username_pw_set(self.username, self.password)
@@ -89,6 +95,17 @@ class VPDMonitor:
         
         return round(vpd, 3)
     
+    def compute_vpd(self) -> np.ndarray:
+        """
+        VPD for every tower at once (same Magnus formula as calculate_vpd)
+        
+        Returns:
+            VPD in kPa per tower, NaN where a reading is still missing
+        """
+        T = self._air_temp
+        es = 0.61078 * np.exp((17.27 * T) / (T + 237.3))
+        return np.round(es * (1.0 - self._air_hum / 100.0), 3)
+    
     def get_vpd_status(self, vpd: float, tower: str) -> str:
         """
         Get VPD status relative to ideal range
@@ -143,32 +160,28 @@ class VPDMonitor:
             tower = parts[0]  # "cool" or "warm"
             sensor = parts[1]  # "air_temp" or "air_humidity"
             
-            if tower not in self.tower_data:
+            i = self._tidx.get(tower)
+            if i is None:
                 return
             
-            # Update tower data
+            # Update tower readings
             if sensor == "air_temp":
                 # Convert Fahrenheit to Celsius
-                temp_c = (value - 32) * 5/9
-                self.tower_data[tower]["air_temp"] = temp_c
+                self._air_temp[i] = (value - 32) * 5/9
             elif sensor == "air_humidity":
-                self.tower_data[tower]["air_humidity"] = value
+                self._air_hum[i] = value
             
             # Calculate VPD if we have both values
-            if (self.tower_data[tower]["air_temp"] is not None and 
-                self.tower_data[tower]["air_humidity"] is not None):
-                
-                vpd = self.calculate_vpd(
-                    self.tower_data[tower]["air_temp"],
-                    self.tower_data[tower]["air_humidity"]
-                )
+            vpd = float(self.compute_vpd()[i])
+            if not math.isnan(vpd):
+                temp_c = float(self._air_temp[i])
+                humidity = float(self._air_hum[i])
                 
                 old_vpd = self.tower_data[tower]["vpd"]
                 self.tower_data[tower]["vpd"] = vpd
                 
                 # Publish VPD value
-                vpd_topic = f"/{tower}/vpd"
-                client.publish(vpd_topic, vpd, retain=True)
+                client.publish(self._vpd_topic[tower], vpd, retain=True)
                 
                 # Publish detailed VPD status
                 status = self.get_vpd_status(vpd, tower)
@@ -177,15 +190,14 @@ class VPDMonitor:
                     "status": status,
                     "ideal_min": self.tower_data[tower]["ideal_range"][0],
                     "ideal_max": self.tower_data[tower]["ideal_range"][1],
-                    "temp_c": round(self.tower_data[tower]["air_temp"], 2),
-                    "temp_f": round((self.tower_data[tower]["air_temp"] * 9/5) + 32, 2),
-                    "humidity_pct": self.tower_data[tower]["air_humidity"],
+                    "temp_c": round(temp_c, 2),
+                    "temp_f": round((temp_c * 9/5) + 32, 2),
+                    "humidity_pct": humidity,
                     "recommendation": self.get_recommendation(vpd, tower),
                     "timestamp": datetime.now().isoformat()
                 }
                 
-                status_topic = f"/{tower}/vpd_status"
-                client.publish(status_topic, json.dumps(status_data), retain=True)
+                client.publish(self._status_topic[tower], json.dumps(status_data), retain=True)
                 
                 # Check for alerts
                 if status != "optimal":
@@ -215,8 +227,8 @@ class VPDMonitor:
                 
                 logger.info(
                     f"{tower.upper()}: VPD={vpd} kPa, Status={status}, "
-                    f"Temp={self.tower_data[tower]['air_temp']:.1f}°C, "
-                    f"RH={self.tower_data[tower]['air_humidity']:.1f}%"
+                    f"Temp={temp_c:.1f}°C, "
+                    f"RH={humidity:.1f}%"
                 )
         
         except Exception as e: